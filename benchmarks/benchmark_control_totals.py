@@ -0,0 +1,147 @@
+"""
+Benchmarks the grouped control totals engine of ControlTotalsBuilder.build_control_totals against the
+original per column groupby().apply implementation, and verifies both produce identical controls.
+
+Run from the repository root:
+
+    python -m benchmarks.benchmark_control_totals --zones 2400 --households 150000
+"""
+import argparse
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from logzero import logger
+
+from gtamodel_popsyn.constants import AGE_BINS, ROAMING_ZONE_ID
+from gtamodel_popsyn.control_totals_builder import ControlTotalsBuilder
+from gtamodel_popsyn.gtamodel_popsyn_config import ZoneIndex
+from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
+
+
+def _sum_column(group, column, value, weight='weighth'):
+    return group[group[column] == value][weight].sum()
+
+
+def _sum_column_gte(group, column, value, weight='weighth'):
+    return group[group[column] >= value][weight].sum()
+
+
+def _sum_column_range(group, column, value, value2, weight='weighth'):
+    return group[(group[column] >= value) & (group[column] <= value2)][weight].sum()
+
+
+def legacy_control_totals(households, persons_households, zones, internal_zone_range, external_zone_range):
+    """
+    The original control totals computation, one groupby().apply per control column.
+    """
+    age_bin_columns = [f'age{age_bin.start}_{age_bin.stop}' for age_bin in AGE_BINS]
+    zones = zones[zones['Zone'].isin(internal_zone_range)]
+    controls = pd.DataFrame(index=pd.Index(zones['Zone'], name='maz'))
+    hh2_group = households.groupby(['HouseholdZone'])
+    hh_group = persons_households.groupby(['HouseholdZone'])
+
+    controls['totpop'] = hh_group.weightp.sum()
+    controls['totalhh'] = hh2_group.weighth.sum()
+    controls['male'] = hh_group.apply(lambda x: _sum_column(x, 'Sex', 'M', 'weightp'))
+    controls['female'] = hh_group.apply(lambda x: _sum_column(x, 'Sex', 'F', 'weightp'))
+    controls['employment_zone_internal'] = \
+        hh_group.apply(lambda x: x[x.EmploymentZone.isin(internal_zone_range)]['weightp'].sum())
+    controls['employment_zone_roaming'] = \
+        hh_group.apply(lambda x: x[x.EmploymentZone == ROAMING_ZONE_ID]['weightp'].sum())
+    controls['employment_zone_external'] = \
+        hh_group.apply(lambda x: x.loc[(x.EmploymentZone.isin(external_zone_range)) &
+                                       (x.EmploymentZone != ROAMING_ZONE_ID), 'weightp'].sum())
+    controls['employment_zone_0'] = hh_group.apply(lambda x: x.loc[(x.EmploymentZone == 0), 'weightp'].sum())
+    for income_class in range(1, 7):
+        controls[f'income_class_{income_class}'] = hh2_group.apply(
+            lambda x: _sum_column(x, 'IncomeClass', income_class, 'weighth'))
+    for size in range(1, 4):
+        controls[f'hhsize{size}'] = hh2_group.apply(lambda x: _sum_column(x, 'NumberOfPersons', size, 'weighth'))
+    controls['hhsize4p'] = hh2_group.apply(lambda x: _sum_column_gte(x, 'NumberOfPersons', 4, 'weighth'))
+    for index, age_bin in enumerate(age_bin_columns):
+        controls[age_bin] = hh_group.apply(
+            lambda x: _sum_column_range(x, 'Age', AGE_BINS[index].start, AGE_BINS[index].stop, 'weightp'))
+    for status in ['J', 'P', 'F', 'O', 'H']:
+        controls[f'E_{status}'] = hh_group.apply(lambda x: _sum_column(x, 'EmploymentStatus', status, 'weightp'))
+    for occupation in ['P', 'G', 'S', 'M', 'O']:
+        controls[occupation] = hh_group.apply(lambda x: _sum_column(x, 'Occupation', occupation, 'weightp'))
+    controls['license_Y'] = hh_group.apply(lambda x: _sum_column(x, 'License', 'Y', 'weightp'))
+    controls['license_N'] = hh_group.apply(lambda x: _sum_column(x, 'License', 'N', 'weightp'))
+    for status in ['O', 'S', 'P']:
+        controls[f'S_{status}'] = hh_group.apply(lambda x: _sum_column(x, 'StudentStatus', status, 'weightp'))
+    return controls.fillna(0)
+
+
+def generate_seed(zone_count: int, household_count: int, seed: int = 12345):
+    """
+    Generates a random seed population shaped like the processed TTS seed records.
+    """
+    rng = np.random.RandomState(seed)
+    zones = pd.DataFrame({'Zone': np.arange(1, zone_count + 1)})
+    zones['PD'] = (zones['Zone'] - 1) * 46 // zone_count + 1
+    zones['puma'] = (zones['PD'] - 1) // 12 + 1
+
+    households = pd.DataFrame({'HouseholdId': np.arange(1, household_count + 1),
+                               'HouseholdZone': rng.randint(1, zone_count + 1, household_count),
+                               'NumberOfPersons': rng.randint(1, 7, household_count),
+                               'IncomeClass': rng.randint(1, 7, household_count),
+                               'weighth': np.round(rng.uniform(5, 60, household_count), 4)})
+
+    persons = households.loc[households.index.repeat(households['NumberOfPersons'])].reset_index(drop=True)
+    person_count = len(persons)
+    persons['Age'] = rng.randint(0, 99, person_count)
+    persons['Sex'] = rng.choice(['M', 'F'], person_count)
+    persons['License'] = rng.choice(['Y', 'N'], person_count)
+    persons['EmploymentStatus'] = rng.choice(['O', 'F', 'P', 'J', 'H'], person_count)
+    persons['Occupation'] = rng.choice(['G', 'S', 'M', 'P', 'O'], person_count)
+    persons['StudentStatus'] = rng.choice(['O', 'S', 'P'], person_count)
+    persons['EmploymentZone'] = rng.choice([0, 0, ROAMING_ZONE_ID, 7000, 1, zone_count // 2], person_count)
+    persons['weightp'] = persons['weighth']
+    return zones, households, persons
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--zones', type=int, default=2400)
+    parser.add_argument('--households', type=int, default=150000)
+    args = parser.parse_args()
+
+    zones, households, persons_households = generate_seed(args.zones, args.households)
+    internal_zone_range = generate_zone_ranges([[1, 5999]])
+    external_zone_range = generate_zone_ranges([[6000, 8887]])
+
+    with tempfile.TemporaryDirectory() as output_path:
+        instance = SimpleNamespace(logger=logger, output_path=output_path, arguments=None,
+                                   config={'MazLevelControls': 'maz.csv', 'TazLevelControls': 'taz.csv',
+                                           'MetaLevelControls': 'meta.csv', 'DropControlColumns': []})
+        builder = ControlTotalsBuilder(instance)
+        zone_index = ZoneIndex(internal_zone_range, external_zone_range, zones.set_index('Zone')['PD'])
+        builder.popsyn_config = SimpleNamespace(internal_zone_range=internal_zone_range,
+                                                external_zone_range=external_zone_range, zone_index=zone_index)
+        os.makedirs(f'{output_path}/Inputs')
+
+        start = time.perf_counter()
+        legacy = legacy_control_totals(households, persons_households, zones,
+                                       internal_zone_range, external_zone_range)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        builder.build_control_totals(households, persons_households, zones)
+        engine_time = time.perf_counter() - start
+
+    controls = builder.controls[legacy.columns].astype(np.float64)
+    identical = np.array_equal(controls.to_numpy(), legacy.astype(np.float64).to_numpy())
+
+    print(f'zones: {args.zones}, households: {len(households)}, persons: {len(persons_households)}')
+    print(f'legacy groupby().apply path: {legacy_time:.3f}s')
+    print(f'grouped aggregation engine:  {engine_time:.3f}s (includes writing control files)')
+    print(f'speedup: {legacy_time / engine_time:.1f}x')
+    print(f'bit-identical controls: {identical}')
+
+
+if __name__ == '__main__':
+    main()
@@ -67,16 +67,17 @@ parser.add_argument('-f', '--forecast-population',
                     action="store",
                     type=argparse.FileType('r'),
                     help='Scale input controls to match a population vector. '
-                         'Assumes two columns, zone and total population.')
+                         'Assumes a zone column followed by one total population column per horizon.')
 parser.add_argument('-g', '--generate-pumas',
                     required=False,
                     action="store_true",
-                    help="Should the database auto generate puma values")
+                    help="Generate GeneratePumas balanced puma values instead of using PdGroups")
 parser.add_argument('-S', '--slice-population',
                     required=False,
                     action='store',
                     type=float,
-                    help='Take a slice (sample) of the population while adjusting weights accordingly')
+                    help='Take a slice (sample) of the population while adjusting weights accordingly. '
+                         'Slices the synthesized population of the output folder passed with -o.')
 parser.add_argument('-m', '--merge-output',
                     required=False,
                     action="store",
@@ -85,61 +86,70 @@ parser.add_argument('-m', '--merge-output',
                     help='Merge and (merge) multiple household and persons file when generating the output. '
                          'Must be used with -u')
 
-args = parser.parse_args()
-
-try:
-    config = json.load(args.config)
-except:
-    logger.error('Unable to load configuration file.')
-    logger.info("GTAModel PopSyn will now terminate.")
-    sys.exit(1)
-
-start_time = datetime.datetime.now()
-
-if args.database_only:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time)
-    gtamodel_popsyn.initialize_database()
-
-elif args.use_database_controls:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only, name=args.name)
-    gtamodel_popsyn.post_input_run()
-
-elif args.use_file_controls:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, name=args.name,
-                                     population_vector=args.forecast_population or None)
-    gtamodel_popsyn.generate_inputs(False)
-    gtamodel_popsyn.initialize_database_with_controls(args.use_file_controls[0],
-                                                      args.use_file_controls[1],
-                                                      args.use_file_controls[2],
-                                                      gen_puma=args.generate_pumas)
-    gtamodel_popsyn.post_input_run()
-
-elif args.input_process_only:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time)
-    gtamodel_popsyn.generate_inputs()
-
-elif args.use_generated:
-
-    logger.info('Using generated input from: ' + args.output_only)
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only,
-                                     make_output=False)
-    gtamodel_popsyn.initialize_database()
-
-elif args.output_only:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only,
-                                     make_output=False)
-    gtamodel_popsyn.generate_outputs(args.saved_output)
-    gtamodel_popsyn.generate_summary_report()
-
-elif args.validation_report_only:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.validation_report_only,
-                                     make_output=False)
-    gtamodel_popsyn.generate_summary_report()
-
-else:
-    gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time,
-                                     percent_populations=[args.percent_population], name=args.name,
-                                     population_vector=args.forecast_population or None)
-    gtamodel_popsyn.run()
-
-# generating full report
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    try:
+        config = json.load(args.config)
+    except:
+        logger.error('Unable to load configuration file.')
+        logger.info("GTAModel PopSyn will now terminate.")
+        sys.exit(1)
+
+    start_time = datetime.datetime.now()
+
+    if args.database_only:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time)
+        gtamodel_popsyn.initialize_database()
+
+    elif args.use_database_controls:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only, name=args.name)
+        gtamodel_popsyn.post_input_run()
+
+    elif args.use_file_controls:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, name=args.name,
+                                         population_vector=args.forecast_population or None)
+        gtamodel_popsyn.generate_inputs(False, gen_pumas=args.generate_pumas)
+        gtamodel_popsyn.initialize_database_with_controls(args.use_file_controls[0],
+                                                          args.use_file_controls[1],
+                                                          args.use_file_controls[2],
+                                                          gen_puma=args.generate_pumas)
+        gtamodel_popsyn.post_input_run()
+
+    elif args.input_process_only:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time)
+        gtamodel_popsyn.generate_inputs(gen_pumas=args.generate_pumas)
+
+    elif args.slice_population:
+        if not args.output_only:
+            logger.error('Slicing a population requires the output folder of the population (-o).')
+            sys.exit(1)
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only,
+                                         make_output=False)
+        gtamodel_popsyn.slice_population(args.slice_population)
+
+    elif args.use_generated:
+
+        logger.info('Using generated input from: ' + args.output_only)
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only,
+                                         make_output=False)
+        gtamodel_popsyn.initialize_database()
+
+    elif args.output_only:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.output_only,
+                                         make_output=False)
+        gtamodel_popsyn.generate_outputs(args.saved_output)
+        gtamodel_popsyn.generate_summary_report()
+
+    elif args.validation_report_only:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time, output_path=args.validation_report_only,
+                                         make_output=False)
+        gtamodel_popsyn.generate_summary_report()
+
+    else:
+        gtamodel_popsyn = GTAModelPopSyn(config, args, start_time=start_time,
+                                         percent_populations=[args.percent_population], name=args.name,
+                                         population_vector=args.forecast_population or None)
+        gtamodel_popsyn.run()
+
+    # generating full report
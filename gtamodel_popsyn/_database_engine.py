@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+
+
+class DatabaseEngine(object):
+    """
+    Database engine shared by the processors of a GTAModelPopSyn instance. The engine and its connection
+    pool are only created once a session is opened, so that runs which never touch the database never
+    connect to it.
+
+    The pool is sized by DatabasePoolSize (default 5) and DatabasePoolMaxOverflow (default 5) connections,
+    recycled after DatabasePoolRecycle seconds (default 3600) and checked before use.
+    """
+
+    def __init__(self, config):
+        """
+
+        :param config:
+        """
+        self._config = config
+        self._engine: Engine = None
+
+    @property
+    def engine(self) -> Engine:
+        """
+        The pooled engine, created on first use.
+        :return:
+        """
+        if self._engine is None:
+            self._engine = create_engine(
+                f'mysql+pymysql://{self._config["DatabaseUser"]}:{self._config["DatabasePassword"]}'
+                f'@{self._config["DatabaseServer"]}/{self._config["DatabaseName"]}',
+                pool_size=int(self._config.get('DatabasePoolSize', 5)),
+                max_overflow=int(self._config.get('DatabasePoolMaxOverflow', 5)),
+                pool_recycle=int(self._config.get('DatabasePoolRecycle', 3600)),
+                pool_pre_ping=True,
+                connect_args={'local_infile': bool(self._config.get('DatabaseBulkLoad', True))})
+        return self._engine
+
+    @contextmanager
+    def session(self):
+        """
+        Checks out a pooled connection for a processing stage, within a single transaction that is committed
+        when the stage completes and rolled back if it fails. Statements of the stage therefore do not commit
+        individually (MySQL still commits implicitly around DDL statements).
+        :return: The connection of the session.
+        """
+        with self.engine.connect() as connection:
+            with connection.begin():
+                yield connection
+
+    def dispose(self):
+        """
+        Closes the pooled connections, if the engine was created.
+        :return:
+        """
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
@@ -1,11 +1,18 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from shutil import copyfile
 
 from pandas import DataFrame
 import pandas as pd
-from sqlalchemy import Table, Column, Integer, MetaData, FLOAT, VARCHAR, PrimaryKeyConstraint
-from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine
+from sqlalchemy import Table, Column, MetaData, inspect
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.util.bulk_load import bulk_load
+from gtamodel_popsyn.util.control_changes import control_changes
+from gtamodel_popsyn.util.frame_fingerprint import frame_fingerprint
+from gtamodel_popsyn.util.infer_sql_types import infer_sql_types, sql_type_names
+from gtamodel_popsyn.util.intermediate_store import read_intermediate
 
 
 class DatabaseProcessor(GTAModelPopSynProcessor):
@@ -14,13 +21,21 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
     and read in the appropriate input data.
     """
 
-    PANDAS_DTYPE_SQL_TYPE = {
-        'int64': Integer,
-        'int32': Integer,
-        'float64': FLOAT,
-        'float32': FLOAT,
-        'object': VARCHAR(1)
-    }
+    SEED_TABLES = ['pumf_hh', 'pumf_person', 'hhtable', 'perstable']
+
+    FINGERPRINT_TABLE = 'popsyn_table_fingerprints'
+
+    @property
+    def _connection(self):
+        """
+        The session connection of the current thread.
+        :return:
+        """
+        return getattr(self._local, 'connection', None)
+
+    @_connection.setter
+    def _connection(self, connection):
+        self._local.connection = connection
 
     def __init__(self, gtamodel_popsyn_instance, percent_population: float):
         """
@@ -29,15 +44,166 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         :param percent_population:
         """
         GTAModelPopSynProcessor.__init__(self, gtamodel_popsyn_instance)
-        self._engine: Engine = None
-        self._connection = None
+        self._database = gtamodel_popsyn_instance.database
+        self._local = threading.local()
         self._percent_population = percent_population
+        self._bulk_load = self._config.get('DatabaseBulkLoad', True)
+        self._insert_chunk_size = int(self._config.get('DatabaseInsertChunkSize', 5000))
+        self._derive_working_tables = self._config.get('DatabaseDeriveWorkingTables', False)
+        self._partition_by_puma = self._config.get('DatabasePartitionByPuma', False)
+        self._skip_unchanged = self._config.get('DatabaseSkipUnchanged', True)
+        self._upsert_controls = self._config.get('DatabaseUpsertControls', False)
+        self._enum_limit = int(self._config.get('DatabaseEnumLimit', 32))
+        self._load_workers = int(self._config.get('DatabaseLoadWorkers', 1))
+        self._load_chunk_size = int(self._config.get('DatabaseLoadChunkSize', 100000))
+
+    @contextmanager
+    def _session(self):
+        """
+        Opens the database session of a loading stage, creating the fingerprint table if required.
+        :return:
+        """
+        with self._database.session() as connection:
+            self._connection = connection
+            if self._skip_unchanged:
+                self._connection.execute(
+                    f'CREATE TABLE IF NOT EXISTS `{self.FINGERPRINT_TABLE}` (`table_name` VARCHAR(64) PRIMARY KEY, '
+                    f'`fingerprint` CHAR(64) NOT NULL)')
+            yield
+
+    def _in_session(self, task):
+        """
+        Runs a task in its own session (pooled connection and transaction).
+        :param task:
+        :return: The result of the task.
+        """
+        with self._database.session() as connection:
+            self._connection = connection
+            return task()
+
+    def _run_tasks(self, tasks: list, session: bool = True) -> list:
+        """
+        Runs independent tasks, in a pool of DatabaseLoadWorkers threads when more than one worker is configured.
+        Database tasks then each run in their own session, committed when the task completes, otherwise they run
+        in order in the current session.
+        :param tasks: Functions without arguments.
+        :param session: Whether the tasks use the database.
+        :return: The results of the tasks, in order.
+        """
+        if self._load_workers <= 1:
+            return [task() for task in tasks]
+        with ThreadPoolExecutor(max_workers=min(self._load_workers, max(len(tasks), 1))) as executor:
+            return list(executor.map(self._in_session if session else (lambda task: task()), tasks))
 
-    def _init_connection(self):
-        self._engine = create_engine(
-            f'mysql+pymysql://{self._config["DatabaseUser"]}:{self._config["DatabasePassword"]}'
-            f'@{self._config["DatabaseServer"]}/{self._config["DatabaseName"]}')
-        self._connection = self._engine.connect()
+    def _unchanged(self, table_name: str, fingerprint: str) -> bool:
+        """
+        Whether the table exists and was last loaded with content of the same fingerprint.
+        :param table_name:
+        :param fingerprint:
+        :return:
+        """
+        if not self._skip_unchanged or not self._connection.dialect.has_table(self._connection, table_name):
+            return False
+        stored = self._connection.execute(
+            f'SELECT `fingerprint` FROM `{self.FINGERPRINT_TABLE}` WHERE `table_name` = %s', (table_name,)).scalar()
+        return stored == fingerprint
+
+    def _store_fingerprint(self, table_name: str, fingerprint: str = None):
+        """
+        Records the fingerprint of a loaded table, or clears it (None) before the table is rewritten. Cleared
+        fingerprints are kept as empty rows rather than deleted, so that tables loaded concurrently do not
+        contend for the gap locks of deleted rows.
+        :param table_name:
+        :param fingerprint:
+        :return:
+        """
+        if not self._skip_unchanged:
+            return
+        self._connection.execute(
+            f'INSERT INTO `{self.FINGERPRINT_TABLE}` (`table_name`, `fingerprint`) VALUES (%s, %s) '
+            f'ON DUPLICATE KEY UPDATE `fingerprint` = VALUES(`fingerprint`)', (table_name, fingerprint or ''))
+
+    def _load_table(self, records: pd.DataFrame, table_name: str):
+        """
+        Appends records to a table with LOAD DATA LOCAL INFILE, or chunked multi row inserts when bulk
+        loading is disabled (DatabaseBulkLoad) or rejected by the server. Once rejected, the remaining
+        tables are inserted directly.
+        :param records:
+        :param table_name:
+        :return:
+        """
+        loaded = bulk_load(records, table_name, self._connection, local_infile=self._bulk_load,
+                           chunk_size=self._insert_chunk_size, load_chunk_size=self._load_chunk_size)
+        if self._bulk_load and not loaded:
+            self._logger.warning('LOAD DATA LOCAL INFILE was rejected, inserting records instead. '
+                                 'Enable local_infile on the database server for faster loading.')
+            self._bulk_load = False
+        self._logger.info(f'Loaded {len(records)} records into {table_name}.')
+
+    def _index_table(self, table_name: str, indexes: list, primary_key: list = None, unique: list = None,
+                     partitions: int = 0):
+        """
+        Builds the keys and secondary indexes of a loaded table in a single ALTER TABLE, and optionally
+        partitions it by puma (the puma is then appended to its primary and unique keys, as MySQL requires).
+        :param table_name:
+        :param indexes: Columns that each receive a secondary index.
+        :param primary_key: Columns of the primary key.
+        :param unique: Columns of a unique key.
+        :param partitions: Number of puma hash partitions, 0 to leave the table unpartitioned.
+        :return:
+        """
+        def key(columns):
+            columns = columns + ['puma'] if partitions and 'puma' not in columns else columns
+            return ', '.join(f'`{c}`' for c in columns)
+
+        alterations = [f'ADD INDEX `{c}` (`{c}`)' for c in indexes]
+        if primary_key:
+            alterations.insert(0, f'ADD PRIMARY KEY ({key(primary_key)})')
+        if unique:
+            alterations.insert(0, f'ADD UNIQUE INDEX `{"_".join(unique)}` ({key(unique)})')
+        partitioning = f' PARTITION BY HASH(`puma`) PARTITIONS {partitions}' if partitions else ''
+        self._connection.execute(f'ALTER TABLE `{table_name}` {", ".join(alterations)}{partitioning}')
+
+    def _update_controls(self, controls: pd.DataFrame, table_name: str, keys: list) -> bool:
+        """
+        Updates a stored control table in place: the rows of the controls that are new or changed are written
+        with batched INSERT ... ON DUPLICATE KEY UPDATE statements, and the stored rows whose keys are no longer
+        present are deleted.
+        :param controls:
+        :param table_name:
+        :param keys: The primary key columns of the table.
+        :return: False if the table cannot be updated in place (missing, without its primary key, with other
+        columns, or with column types that do not hold the new controls).
+        """
+        if not self._connection.dialect.has_table(self._connection, table_name):
+            return False
+        # a table left unkeyed (e.g. by a failed ALTER TABLE) would take duplicates instead of updates
+        if inspect(self._connection).get_pk_constraint(table_name)['constrained_columns'] != keys:
+            return False
+        stored = pd.read_sql(f'SELECT * FROM `{table_name}`', self._connection)
+        if list(stored.columns) != list(controls.columns) or \
+                sql_type_names(infer_sql_types(pd.concat([stored, controls]), self._enum_limit)) != \
+                sql_type_names(infer_sql_types(stored, self._enum_limit)):
+            return False
+
+        changed, removed = control_changes(controls, stored, keys)
+        columns = ', '.join(f'`{c}`' for c in controls.columns)
+        updates = ', '.join(f'`{c}` = VALUES(`{c}`)' for c in controls.columns if c not in keys)
+        placeholders = f'({", ".join(["%s"] * len(keys))})'
+        for start in range(0, len(removed), self._insert_chunk_size):
+            batch = removed.iloc[start:start + self._insert_chunk_size].astype(object)
+            self._connection.execute(
+                f'DELETE FROM `{table_name}` WHERE ({", ".join(f"`{c}`" for c in keys)}) IN '
+                f'({", ".join([placeholders] * len(batch))})',
+                [value for row in batch.itertuples(index=False, name=None) for value in row])
+        for start in range(0, len(changed), self._insert_chunk_size):
+            batch = changed.iloc[start:start + self._insert_chunk_size].astype(object)
+            batch = batch.where(batch.notna(), None)
+            self._connection.execute(
+                f'INSERT INTO `{table_name}` ({columns}) VALUES ({", ".join(["%s"] * len(controls.columns))}) '
+                f'ON DUPLICATE KEY UPDATE {updates}', list(batch.itertuples(index=False, name=None)))
+        self._logger.info(f'Updated {len(changed)} and deleted {len(removed)} rows of {table_name}.')
+        return True
 
     def initialize_database(self, persons=None, households=None):
         """
@@ -47,10 +213,9 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         :return:
         """
 
-        self._init_connection()
-        self._initialize_record_tables(persons, households)
-        self._initialize_control_tables()
-        self._connection.close()
+        with self._session():
+            self._initialize_record_tables(persons, households)
+            self._initialize_control_tables()
 
     def initialize_database_with_control_files(self, maz: str, taz: str, meta: str, gen_puma=False):
         """
@@ -59,10 +224,9 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         @param taz:
         @param meta:
         """
-        self._init_connection()
-        self.initialize_control_tables_from_file(maz, taz, meta, gen_puma)
-        self._initialize_record_tables(None, None)
-        self._connection.close()
+        with self._session():
+            self.initialize_control_tables_from_file(maz, taz, meta, gen_puma)
+            self._initialize_record_tables(None, None)
 
     def initialize_database_with_existing_controls(self, maz: pd.DataFrame, taz: pd.DataFrame, meta: pd.DataFrame):
         """
@@ -71,10 +235,9 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         @param taz:
         @param meta:
         """
-        self._init_connection()
-        self.initialize_control_tables_from_existing(maz, taz, meta)
-        self._initialize_record_tables(None, None)
-        self._connection.close()
+        with self._session():
+            self.initialize_control_tables_from_existing(maz, taz, meta)
+            self._initialize_record_tables(None, None)
 
     def _initialize_record_tables(self, persons: DataFrame = None, households: pd.DataFrame = None):
         """
@@ -85,62 +248,95 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         :return:
         """
 
-        if persons is None:
-            persons: pd.DataFrame = pd.read_csv(
-                f"{self._config['ProcessedPersonsSeedFile']}")
-
-        if households is None:
-            households: pd.DataFrame = pd.read_csv(
-                f"{self._config['ProcessedHouseholdsSeedFile']}")
+        intermediate_format = self._config.get('IntermediateFormat', 'csv')
+        persons, households = self._run_tasks(
+            [(lambda: persons) if persons is not None else
+             partial(read_intermediate, f"{self._config['ProcessedPersonsSeedFile']}", intermediate_format),
+             (lambda: households) if households is not None else
+             partial(read_intermediate, f"{self._config['ProcessedHouseholdsSeedFile']}", intermediate_format)],
+            session=False)
+
+        for records in [households, persons]:
+            for c in records.columns:
+                if records.dtypes[c].name == 'float64':
+                    records[c] = records[c].astype('float32')
+        household_types = infer_sql_types(households, self._enum_limit)
+        person_types = infer_sql_types(persons, self._enum_limit)
+        hhnum_type = infer_sql_types(pd.DataFrame({'hhnum': [1, max(len(households), 1)]}))['hhnum']
+
+        # the seed tables are only reloaded when the seed records, their schema or the way they are loaded change
+        fingerprint = frame_fingerprint(households, persons,
+                                        options=[self._derive_working_tables, self._partition_by_puma,
+                                                 sql_type_names(household_types), sql_type_names(person_types)])
+        if all(self._unchanged(table_name, fingerprint) for table_name in self.SEED_TABLES):
+            self._logger.info('Seed tables are unchanged, skipping their upload.')
+            return
+        for table_name in self.SEED_TABLES:
+            self._store_fingerprint(table_name, None)
 
         metadata = MetaData()
+        households_table = Table('pumf_hh', metadata, *[Column(c, t) for c, t in household_types.items()])
+        persons_table = Table('pumf_person', metadata, *[Column(c, t) for c, t in person_types.items()])
 
-        households_table_columns = [Column(c, self.PANDAS_DTYPE_SQL_TYPE[households.dtypes[c].name]) for c in
-                                    households.columns]
-        households_table = Table('pumf_hh', metadata, *households_table_columns)
-        for c in households.columns:
-            if households.dtypes[c].name == 'float64':
-                households[c] = households[c].astype('float32')
-        households_table.columns[households.columns[0]].primary_key = True
-
-        persons_table_columns = [Column(c, self.PANDAS_DTYPE_SQL_TYPE[persons.dtypes[c].name]) for c in persons.columns]
-        persons_table = Table('pumf_person', metadata, *persons_table_columns)
-        for c in persons.columns:
-            if persons.dtypes[c].name == 'float64':
-                persons[c] = persons[c].astype('float32')
+        # the tables are created without keys, which are built once the records are loaded
+        metadata.drop_all(self._connection, [households_table, persons_table])
+        metadata.create_all(self._connection)
 
-        persons_table.columns[persons.columns[0]].primary_key = True
-        persons_table.columns[persons.columns[0]].primary_key = True
-
-        metadata.drop_all(self._engine, [households_table, persons_table])
-        metadata.create_all(self._engine)
-
-        households.to_sql('pumf_hh', self._connection, if_exists='append', index=False)
-        persons.to_sql('pumf_person', self._connection, if_exists='append', index=False)
+        self._run_tasks([partial(self._load_table, households, 'pumf_hh'),
+                         partial(self._load_table, persons, 'pumf_person')])
 
         # new metadata
         metadata = MetaData()
-        hhtable = Table('hhtable', metadata, *[Column(c, self.PANDAS_DTYPE_SQL_TYPE[households.dtypes[c].name]) for c in
-                                               households.columns],
-                        Column('hhnum', Integer, unique=True, autoincrement=True, nullable=False))
-
-        perstable = Table('perstable', metadata,
-                          *[Column(c, self.PANDAS_DTYPE_SQL_TYPE[persons.dtypes[c].name]) for c in
-                            persons.columns],
-                          Column('hhnum', Integer))
+        hhtable = Table('hhtable', metadata, *[Column(c, t) for c, t in household_types.items()],
+                        Column('hhnum', hhnum_type, nullable=False))
 
-        metadata.drop_all(self._engine, [hhtable, perstable])
-        metadata.create_all(self._engine)
-        hhtable_data = pd.concat([households, pd.Series(range(1, households.shape[0] + 1), dtype=int, name="hhnum")],
-                                 axis=1)
-
-        hhtable_data.to_sql('hhtable', self._connection, if_exists='append', index=False)
-        pd.merge(persons, hhtable_data[['hhnum', 'HouseholdId']], how="left",
-                 left_on="HouseholdId", right_on="HouseholdId").to_sql(
-            'perstable', self._connection, if_exists="append", index=False)
+        perstable = Table('perstable', metadata, *[Column(c, t) for c, t in person_types.items()],
+                          Column('hhnum', hhnum_type))
 
+        metadata.drop_all(self._connection, [hhtable, perstable])
+        metadata.create_all(self._connection)
+        if self._derive_working_tables:
+            self._run_tasks([partial(self._derive_record_tables, list(households.columns), list(persons.columns))])
+        else:
+            hhtable_data = households.assign(hhnum=range(1, households.shape[0] + 1))
+
+            self._run_tasks([partial(self._load_table, hhtable_data, 'hhtable'),
+                             partial(self._load_table,
+                                     pd.merge(persons, hhtable_data[['hhnum', 'HouseholdId']], how="left",
+                                              left_on="HouseholdId", right_on="HouseholdId"), 'perstable')])
+
+        partitions = households['puma'].nunique() if self._partition_by_puma else 0
+        self._run_tasks([
+            partial(self._index_table, 'pumf_hh', ['puma'], primary_key=['HouseholdId'], partitions=partitions),
+            partial(self._index_table, 'pumf_person', ['puma'], primary_key=['HouseholdId', 'PersonNumber'],
+                    partitions=partitions),
+            partial(self._index_table, 'hhtable', ['puma', 'HouseholdId'], unique=['hhnum'], partitions=partitions),
+            partial(self._index_table, 'perstable', ['puma', 'hhnum'], partitions=partitions)])
+        self._logger.info('Built the seed table indexes.')
+        for table_name in self.SEED_TABLES:
+            self._store_fingerprint(table_name, fingerprint)
         return
 
+    def _derive_record_tables(self, household_columns: list, person_columns: list):
+        """
+        Fills hhtable and perstable from the uploaded pumf_hh and pumf_person tables on the server, numbering
+        the households (hhnum) in HouseholdId order with ROW_NUMBER (MySQL 8.0 or later), so that the seed
+        records are only sent once.
+        :param household_columns:
+        :param person_columns:
+        :return:
+        """
+        households = ', '.join(f'`{c}`' for c in household_columns)
+        persons = ', '.join(f'`{c}`' for c in person_columns)
+        self._connection.execute(
+            f'INSERT INTO `hhtable` ({households}, `hhnum`) '
+            f'SELECT {households}, ROW_NUMBER() OVER (ORDER BY `HouseholdId`) FROM `pumf_hh`')
+        self._connection.execute(
+            f'INSERT INTO `perstable` ({persons}, `hhnum`) '
+            f'SELECT {", ".join(f"p.`{c}`" for c in person_columns)}, h.`hhnum` FROM `pumf_person` p '
+            f'LEFT JOIN `hhtable` h ON p.`HouseholdId` = h.`HouseholdId`')
+        self._logger.info('Derived hhtable and perstable from pumf_hh and pumf_person.')
+
     def initialize_control_tables_from_file(self, maz_controls_file, taz_controls_file, meta_controls_file,
                                             gen_puma=False):
         """
@@ -148,15 +344,22 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         @param maz_controls_file:
         @param taz_controls_file:
         @param meta_controls_file:
+        @param gen_puma: Replace the puma of the controls with the pumas generated during input processing.
         """
         self._logger.info("Copying control files to output directory")
 
-        copyfile(maz_controls_file, f"{self._output_path}/Inputs/{self._config['MazLevelControls']}")
-        copyfile(taz_controls_file, f"{self._output_path}/Inputs/{self._config['TazLevelControls']}")
+        maz_controls, taz_controls, meta_controls = self._run_tasks(
+            [partial(pd.read_csv, f"{maz_controls_file}"), partial(pd.read_csv, f"{taz_controls_file}"),
+             partial(pd.read_csv, f"{meta_controls_file}")], session=False)
+        if gen_puma:
+            maz_controls['puma'] = self.popsyn_config.zone_index.zone_pumas(maz_controls['maz'])
+            taz_controls['puma'] = self.popsyn_config.zone_index.zone_pumas(taz_controls['taz'])
+            maz_controls.to_csv(f"{self._output_path}/Inputs/{self._config['MazLevelControls']}", index=False)
+            taz_controls.to_csv(f"{self._output_path}/Inputs/{self._config['TazLevelControls']}", index=False)
+        else:
+            copyfile(maz_controls_file, f"{self._output_path}/Inputs/{self._config['MazLevelControls']}")
+            copyfile(taz_controls_file, f"{self._output_path}/Inputs/{self._config['TazLevelControls']}")
         copyfile(meta_controls_file, f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}")
-        maz_controls = pd.read_csv(f"{maz_controls_file}")
-        taz_controls = pd.read_csv(f"{taz_controls_file}")
-        meta_controls = pd.read_csv(f"{meta_controls_file}")
         self._initialize_control_tables(maz_controls, taz_controls, meta_controls)
 
     def initialize_control_tables_from_existing(self, maz_controls_file, taz_controls_file, meta_controls_file,
@@ -174,32 +377,9 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         meta_controls_file.to_csv(f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}", index=False)
         self._initialize_control_tables(maz_controls_file, taz_controls_file, meta_controls_file)
 
-    def _generate_puma_values(self, population: list):
-        """
-        Generates a mapping of puma geography for taz/maz roughly equally dividided
-        by the number configured in the configuration.
-        @param population:
-        @return:
-        """
-        if 'GeneratePumas ' in self._config:
-            # puma_count = self._config['GeneratePumas']
-            pd_pop = population[-1] / int(self._config['GeneratePumas'])
-            pd_list = []
-            curr_pd = 1
-            curr_sum = population[0]
-            for t in population:
-                pd_list.append(curr_pd)
-                if (t - curr_sum) > pd_pop:
-                    curr_pd = curr_pd + 1
-                    curr_sum = t
-            return pd_list
-        else:
-            return []
-
     def _initialize_control_tables(self, maz_controls: pd.DataFrame = None,
                                    taz_controls: pd.DataFrame = None,
-                                   meta_controls: pd.DataFrame = None,
-                                   gen_puma=False):
+                                   meta_controls: pd.DataFrame = None):
         """
         Initializes database control tables for each level of geography
         :param maz_controls:
@@ -207,58 +387,45 @@ class DatabaseProcessor(GTAModelPopSynProcessor):
         :param meta_controls:
         :return:
         """
-        if maz_controls is None:
-            maz_controls = pd.read_csv(f"{self._output_path}/Inputs/{self._config['MazLevelControls']}")
-
-        if taz_controls is None:
-            taz_controls = pd.read_csv(f"{self._output_path}/Inputs/{self._config['TazLevelControls']}")
-
-        if meta_controls is None:
-            meta_controls = pd.read_csv(f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}")
-
-        metadata = MetaData()
-
-        if gen_puma:
-            pd_list = self._generate_puma_values(maz_controls.puma.cumsum().tolist())
-            if len(pd_list) == len(maz_controls):
-                maz_controls['puma'] = pd_list
-                taz_controls['puma'] = pd_list
-
-        maz_columns = [
-            Column(maz_controls.columns[0], self.PANDAS_DTYPE_SQL_TYPE[maz_controls.dtypes[0].name], primary_key=True),
-            Column(maz_controls.columns[1], self.PANDAS_DTYPE_SQL_TYPE[maz_controls.dtypes[1].name], primary_key=True),
-            Column(maz_controls.columns[2], self.PANDAS_DTYPE_SQL_TYPE[maz_controls.dtypes[2].name], primary_key=True),
-            Column(maz_controls.columns[3], self.PANDAS_DTYPE_SQL_TYPE[maz_controls.dtypes[3].name], primary_key=True)]
-        maz_columns.extend([Column(c, self.PANDAS_DTYPE_SQL_TYPE[maz_controls.dtypes[c].name]) for c in
-                            maz_controls.columns[4:]])
-        maz_controls_table = Table('control_totals_maz', metadata,
-                                   *maz_columns, PrimaryKeyConstraint('region', 'puma', 'taz', 'maz',
-                                                                      name='maz_pk'))
-
-        taz_columns = [Column(c, self.PANDAS_DTYPE_SQL_TYPE[taz_controls.dtypes[c].name]) for c in
-                       taz_controls.columns]
-        taz_columns[0].primary_key = True
-        taz_columns[1].primary_key = True
-        taz_columns[2].primary_key = True
-        taz_controls_table = Table('control_totals_taz', metadata,
-                                   *taz_columns)
-
-        meta_columns = [Column(c, self.PANDAS_DTYPE_SQL_TYPE[meta_controls.dtypes[c].name]) for c in
-                        meta_controls.columns]
-        meta_columns[0].primary_key = True
-        meta_controls_table = Table('control_totals_meta', metadata, *meta_columns)
-
-        metadata.drop_all(self._engine, [maz_controls_table, taz_controls_table, meta_controls_table])
-        metadata.create_all(self._engine)
-
-        maz_controls.to_sql('control_totals_maz', self._connection, if_exists='replace', index=False)
-        taz_controls.to_sql('control_totals_taz', self._connection, if_exists='replace', index=False)
-        meta_controls.to_sql('control_totals_meta', self._connection, if_exists='replace', index=False)
-
-        self._connection.execute('ALTER TABLE `control_totals_maz` ADD PRIMARY KEY (`region`,`puma`,`taz`,`maz`);')
-        self._connection.execute('ALTER TABLE `control_totals_taz` ADD PRIMARY KEY (`region`,`puma`,`taz`);')
-        self._connection.execute('ALTER TABLE `control_totals_meta` ADD PRIMARY KEY (`region`);')
+        intermediate_format = self._config.get('IntermediateFormat', 'csv')
+        maz_controls, taz_controls, meta_controls = self._run_tasks(
+            [(lambda controls=controls: controls) if controls is not None else
+             partial(read_intermediate, f"{self._output_path}/Inputs/{self._config[file_key]}", intermediate_format)
+             for controls, file_key in [(maz_controls, 'MazLevelControls'), (taz_controls, 'TazLevelControls'),
+                                        (meta_controls, 'MetaLevelControls')]], session=False)
+
+        self._run_tasks([
+            partial(self._initialize_control_table, maz_controls, 'control_totals_maz', ['maz', 'taz'],
+                    ['region', 'puma', 'taz', 'maz']),
+            partial(self._initialize_control_table, taz_controls, 'control_totals_taz', ['taz'],
+                    ['region', 'puma', 'taz']),
+            partial(self._initialize_control_table, meta_controls, 'control_totals_meta', [], ['region'])])
         return
 
+    def _initialize_control_table(self, controls: pd.DataFrame, table_name: str, indexes: list, primary_key: list):
+        """
+        Loads a control table, unless its content is unchanged. The table is created with the inferred column types
+        and without keys, then loaded and indexed, or updated in place in upsert mode (DatabaseUpsertControls).
+        :param controls:
+        :param table_name:
+        :param indexes: Columns that each receive a secondary index.
+        :param primary_key: Columns of the primary key.
+        :return:
+        """
+        sql_types = infer_sql_types(controls, self._enum_limit)
+        fingerprint = frame_fingerprint(controls, options=sql_type_names(sql_types))
+        if self._unchanged(table_name, fingerprint):
+            self._logger.info(f'{table_name} is unchanged, skipping its upload.')
+            return
+        self._store_fingerprint(table_name, None)
+        if not (self._upsert_controls and self._update_controls(controls, table_name, primary_key)):
+            metadata = MetaData()
+            controls_table = Table(table_name, metadata, *[Column(c, t) for c, t in sql_types.items()])
+            metadata.drop_all(self._connection, [controls_table])
+            metadata.create_all(self._connection)
+            self._load_table(controls, table_name)
+            self._index_table(table_name, indexes, primary_key=primary_key)
+        self._store_fingerprint(table_name, fingerprint)
+
     def __del__(self):
         return
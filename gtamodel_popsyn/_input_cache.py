@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+
+from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.util.intermediate_store import INTERMEDIATE_FORMATS, intermediate_path
+
+
+class InputCache(GTAModelPopSynProcessor):
+    """
+    Content addressed cache of the generated control totals and processed seed files. Entries are keyed
+    on a hash of the input files, the configuration affecting input processing and the random seed, and
+    are evicted least recently used first once the cache grows beyond InputCacheSize (MB).
+
+    The cache is enabled by setting InputCacheFolder in the configuration. Runs without a RandomSeed draw
+new samples every time and are never cached.
+    """
+
+    # bump when the input processing changes in a way that invalidates existing entries
+    CACHE_VERSION = 5
+
+    INPUT_FILE_KEYS = ['PersonsSeedFile', 'HouseholdsSeedFile', 'Zones']
+
+    CONFIG_KEYS = ['PdGroups', 'CategoryMapping', 'InputSample', 'ZoneRanges', 'ExternalZoneRanges',
+                   'DropControlColumns', 'ControlDefinitions', 'RandomSeed', 'IntermediateFormat',
+                   'GeneratePumas', 'GeneratePumasWeight', 'GeneratePumasByPd', 'InputSampleStratum',
+                   'InputSampleRescale', 'CompactSeeds']
+
+    @property
+    def enabled(self):
+        return self._cache_folder is not None
+
+    def __init__(self, gtamodel_popsyn_instance):
+        """
+
+        :param gtamodel_popsyn_instance:
+        """
+        GTAModelPopSynProcessor.__init__(self, gtamodel_popsyn_instance)
+        self._cache_folder = self._config.get('InputCacheFolder')
+        if self._cache_folder is not None and 'RandomSeed' not in self._config:
+            self._logger.info('Input cache disabled, as no RandomSeed is configured.')
+            self._cache_folder = None
+        self._cache_size = int(self._config.get('InputCacheSize', 2048)) * 1024 * 1024
+
+    def _artifacts(self, gen_pumas: bool = False) -> dict:
+        """
+        Returns the cached artifacts, mapping the name stored in the cache to its run location.
+        :param gen_pumas: Whether the pumas are generated, adding the puma balance and zone pumas.
+        :return:
+        """
+        file_format = self._config.get('IntermediateFormat', 'csv')
+        extension = INTERMEDIATE_FORMATS[file_format]
+        controls = {
+            'maz_controls': f"{self._output_path}/Inputs/{self._config['MazLevelControls']}",
+            'taz_controls': f"{self._output_path}/Inputs/{self._config['TazLevelControls']}",
+            'meta_controls': f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}"
+        }
+        artifacts = {f'{name}.csv': path for name, path in controls.items()}
+        if file_format != 'csv':
+            artifacts.update({f'{name}{extension}': intermediate_path(path, file_format)
+                              for name, path in controls.items()})
+        artifacts[f'persons_seed{extension}'] = intermediate_path(self._config['ProcessedPersonsSeedFile'], file_format)
+        artifacts[f'households_seed{extension}'] = intermediate_path(self._config['ProcessedHouseholdsSeedFile'],
+                                                                     file_format)
+        if self._config.get('CompactSeeds', False):
+            artifacts['seed_household_map.csv'] = f'{self._output_path}/Inputs/seed_household_map.csv'
+        if gen_pumas and 'GeneratePumas' in self._config:
+            artifacts['puma_balance.csv'] = f'{self._output_path}/Inputs/puma_balance.csv'
+            artifacts['zone_pumas.csv'] = f'{self._output_path}/Inputs/zone_pumas.csv'
+        return artifacts
+
+    def key(self, gen_pumas: bool = False) -> str:
+        """
+        Computes the cache key of the current inputs and configuration.
+        :param gen_pumas: Whether the pumas are generated instead of assigned from PdGroups.
+        :return:
+        """
+        digest = hashlib.sha256()
+        digest.update(str(self.CACHE_VERSION).encode())
+        for file_key in self.INPUT_FILE_KEYS:
+            with open(self._config[file_key], 'rb') as input_file:
+                for chunk in iter(lambda: input_file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        digest.update(json.dumps({k: self._config.get(k) for k in self.CONFIG_KEYS}, sort_keys=True).encode())
+        digest.update(str(bool(gen_pumas)).encode())
+        return digest.hexdigest()
+
+    def restore(self, key: str, gen_pumas: bool = False) -> bool:
+        """
+        Copies the cached artifacts of the key to their run locations.
+        :param key:
+        :param gen_pumas: Whether the pumas are generated.
+        :return: True if the key was found in the cache.
+        """
+        entry = f'{self._cache_folder}/{key}'
+        artifacts = self._artifacts(gen_pumas)
+        if not all(os.path.isfile(f'{entry}/{name}') for name in artifacts):
+            return False
+
+        for name, destination in artifacts.items():
+            shutil.copyfile(f'{entry}/{name}', destination)
+        os.utime(entry)
+        self._logger.info(f'Restored processed inputs from cache entry {key}.')
+        return True
+
+    def store(self, key: str, gen_pumas: bool = False):
+        """
+        Stores the artifacts of the current run under the key, and evicts the least recently used
+        entries that do not fit the cache size.
+        :param key:
+        :param gen_pumas: Whether the pumas are generated.
+        :return:
+        """
+        entry = f'{self._cache_folder}/{key}'
+        staging = f'{entry}.{os.getpid()}.tmp'
+        os.makedirs(staging, exist_ok=True)
+        for name, source in self._artifacts(gen_pumas).items():
+            shutil.copyfile(source, f'{staging}/{name}')
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+        os.utime(entry)
+        self._logger.info(f'Stored processed inputs in cache entry {key}.')
+        self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        """
+        Removes least recently used entries until the cache fits its configured size.
+        :param keep: Entry that is never evicted.
+        :return:
+        """
+        entries = []
+        for name in os.listdir(self._cache_folder):
+            path = f'{self._cache_folder}/{name}'
+            if not os.path.isdir(path) or name.endswith('.tmp'):
+                continue
+            size = sum(os.path.getsize(f'{path}/{f}') for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), name, size))
+
+        total_size = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total_size <= self._cache_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(f'{self._cache_folder}/{name}', ignore_errors=True)
+            total_size -= size
+            self._logger.info(f'Evicted cache entry {name}.')
+        return
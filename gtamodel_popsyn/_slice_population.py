@@ -1 +1,103 @@
+import os
+
+import numpy as np
 import pandas as pd
+
+from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.util.stratified_sample import stratified_sample
+
+
+class PopulationSlicer(GTAModelPopSynProcessor):
+    """
+    Slices (samples) an existing synthesized population. A stratified sample of the households of every
+    zone is kept, with all of their persons, and the expansion factors of each zone are scaled so that
+    the expanded household total of every zone is preserved.
+
+    The population files are streamed in chunks of SliceChunkSize rows (default 1000000): only the
+    household ids, zones and expansion factors are held in memory while the sample is drawn.
+    """
+
+    def __init__(self, gtamodel_popsyn_instance):
+        """
+
+        :param gtamodel_popsyn_instance:
+        """
+        GTAModelPopSynProcessor.__init__(self, gtamodel_popsyn_instance)
+        self._chunk_size = int(self._config.get('SliceChunkSize', 1000000))
+
+    def slice(self, fraction: float, source_folder: str = None) -> str:
+        """
+        Writes a slice of the synthesized population of the source folder to
+        Slices/<fraction>/HouseholdData/ of the source folder.
+        :param fraction: The fraction of the households of each zone to keep.
+        :param source_folder: Output folder of the synthesized population, the run output folder if None.
+        :return: The folder of the sliced population.
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError(f'The population slice must be within (0, 1], got {fraction}.')
+        source_folder = source_folder or self._output_path
+        slice_folder = f'{source_folder}/Slices/{fraction}/HouseholdData'
+        os.makedirs(slice_folder, exist_ok=True)
+
+        self._logger.info(f'Slicing {fraction} of the synthesized population in {source_folder}.')
+        household_ids, factors, zone_totals = self._select_households(
+            f'{source_folder}/HouseholdData/Households.csv', fraction)
+        households = self._write_records(f'{source_folder}/HouseholdData/Households.csv',
+                                         f'{slice_folder}/Households.csv', household_ids, factors)
+        persons = self._write_records(f'{source_folder}/HouseholdData/Persons.csv',
+                                      f'{slice_folder}/Persons.csv', household_ids, factors)
+        zone_totals.to_csv(f'{slice_folder}/HouseholdTotals.csv', index=False)
+
+        self._logger.info(f'Sliced population of {households} households and {persons} persons written to '
+                          f'{slice_folder}.')
+        return slice_folder
+
+    def _select_households(self, households_file: str, fraction: float) -> tuple:
+        """
+        Draws the zone stratified household sample, keeping at least one household of every zone.
+        :param households_file:
+        :param fraction:
+        :return: The sorted ids of the sampled households, the expansion factor scale of each of them and
+        the expanded household totals of the zones.
+        """
+        households = pd.concat(pd.read_csv(households_file, chunksize=self._chunk_size,
+                                           usecols=['HouseholdId', 'HouseholdZone', 'ExpansionFactor']),
+                               ignore_index=True)
+        seed = self._config.get('RandomSeed')
+        selected, _ = stratified_sample(households['HouseholdId'], households['HouseholdZone'], fraction,
+                                        np.random.default_rng(seed), minimum=1)
+
+        # scale the expansion factors of each zone by its total over its sampled total
+        zones, zone_codes = np.unique(households['HouseholdZone'].to_numpy(), return_inverse=True)
+        expansion = households['ExpansionFactor'].to_numpy(dtype=np.float64)
+        totals = np.bincount(zone_codes, weights=expansion, minlength=len(zones))
+        sampled_totals = np.bincount(zone_codes[selected], weights=expansion[selected], minlength=len(zones))
+        scales = np.divide(totals, sampled_totals, out=np.ones(len(zones)), where=sampled_totals > 0)
+
+        household_ids = households['HouseholdId'].to_numpy()[selected]
+        factors = scales[zone_codes[selected]]
+        order = np.argsort(household_ids, kind='stable')
+        return household_ids[order], factors[order], \
+            pd.DataFrame({'Zone': zones, 'ExpandedHouseholds': totals})
+
+    def _write_records(self, source_file: str, destination_file: str, household_ids: np.ndarray,
+                       factors: np.ndarray) -> int:
+        """
+        Streams the records of the sampled households to the destination file, scaling their expansion
+        factors.
+        :param source_file:
+        :param destination_file:
+        :param household_ids: Sorted ids of the sampled households.
+        :param factors: Expansion factor scale of each sampled household.
+        :return: The number of records written.
+        """
+        written = 0
+        for index, chunk in enumerate(pd.read_csv(source_file, chunksize=self._chunk_size)):
+            ids = chunk['HouseholdId'].to_numpy()
+            positions = np.minimum(np.searchsorted(household_ids, ids), max(len(household_ids) - 1, 0))
+            sampled = (household_ids[positions] == ids) if len(household_ids) else np.zeros(len(ids), dtype=bool)
+            chunk = chunk[sampled]
+            chunk = chunk.assign(ExpansionFactor=chunk['ExpansionFactor'].to_numpy() * factors[positions[sampled]])
+            chunk.to_csv(destination_file, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+            written += len(chunk)
+        return written
@@ -0,0 +1,281 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtamodel_popsyn.gtamodel_popsyn_config import ZoneIndex
+from gtamodel_popsyn.util.zone_category_sums import zone_category_sums
+
+"""
+Classes of employment (or school) zones, as derived by classify_zones.
+"""
+ZONE_TYPES = ZoneIndex.ZONE_TYPES
+
+"""
+Attributes of the population cubes built by population_cubes.
+"""
+PERSON_ATTRIBUTES = ['Sex', 'Age', 'Occupation', 'EmploymentStatus', 'StudentStatus', 'EmploymentZoneType']
+HOUSEHOLD_ATTRIBUTES = ['IncomeClass', 'NumberOfPersons']
+
+
+def classify_zones(zones, zone_index: ZoneIndex) -> np.ndarray:
+    """
+    Classifies zone ids as roaming, internal, external, zero or other (in that order of precedence).
+    :param zones: The zone ids.
+    :param zone_index:
+    :return: Array of ZONE_TYPES values, one per zone id.
+    """
+    return np.asarray(ZONE_TYPES, dtype=object)[zone_index.classify(zones)]
+
+
+def file_signatures(paths: list) -> dict:
+    """
+    Identifies the version of files by their name, size and modification time.
+    :param paths:
+    :return: Dictionary of the [size, modification time (ns)] of each file name.
+    """
+    return {os.path.basename(path): [os.path.getsize(path), os.stat(path).st_mtime_ns] for path in paths}
+
+
+def population_cubes(persons_households: pd.DataFrame, households: pd.DataFrame, person_weight: str,
+                     household_weight: str, zone_index: ZoneIndex) -> dict:
+    """
+    Builds the persons (PERSON_ATTRIBUTES) and households (HOUSEHOLD_ATTRIBUTES) cubes of a seed or
+    synthesized population, both by HouseholdZone.
+    :param persons_households: The joined person and household records.
+    :param households: The household records.
+    :param person_weight: Weight column of the person records.
+    :param household_weight: Weight column of the household records.
+    :param zone_index:
+    :return: Mapping of 'persons' and 'households' to their cubes.
+    """
+    persons = persons_households[['HouseholdZone', person_weight] + PERSON_ATTRIBUTES[:-1]].copy()
+    persons['EmploymentZoneType'] = classify_zones(persons_households['EmploymentZone'], zone_index)
+    return {'persons': AggregationCube.build(persons, 'HouseholdZone', PERSON_ATTRIBUTES, [person_weight]),
+            'households': AggregationCube.build(households, 'HouseholdZone', HOUSEHOLD_ATTRIBUTES,
+                                                [household_weight])}
+
+
+class AggregationCube(object):
+    """
+    Sparse zone x attribute category x weight aggregation of a set of records. Only occupied cells
+    are stored, as a coordinate (zone, category of each attribute) and the weighted total of every
+    weight column. Summaries of the population become slices and marginals of the cube, and the zone
+    dimension can be rolled up to PDs, pumas or regions with a zone mapping.
+    """
+
+    @property
+    def zones(self):
+        return self._zones
+
+    @property
+    def attributes(self):
+        return list(self._categories)
+
+    @property
+    def weights(self):
+        return self._weights
+
+    def categories(self, attribute: str) -> pd.Index:
+        """
+        Returns the categories of an attribute, in their coordinate order.
+        :param attribute:
+        :return:
+        """
+        return self._categories[attribute]
+
+    def __init__(self, zones: pd.Index, categories: dict, weights: list, coordinates: np.ndarray, values: np.ndarray):
+        """
+
+        :param zones: The zone dimension.
+        :param categories: Mapping of each attribute to its categories, in dimension order.
+        :param weights: Names of the weight columns.
+        :param coordinates: cells x (1 + attributes) integer coordinates of the occupied cells.
+        :param values: cells x weights totals of the occupied cells.
+        """
+        self._zones = pd.Index(zones)
+        self._categories = {attribute: pd.Index(category_values) for attribute, category_values in categories.items()}
+        self._weights = list(weights)
+        self._coordinates = np.asarray(coordinates, dtype=np.int64).reshape(-1, 1 + len(self._categories))
+        self._values = np.asarray(values, dtype=np.float64).reshape(-1, len(self._weights))
+
+    @staticmethod
+    def build(records: pd.DataFrame, zone_column: str, attributes: list, weights: list,
+              zones: pd.Index = None):
+        """
+        Aggregates records into a cube. Missing attribute values form a trailing NaN category of their
+        attribute, so that the cube totals include every record; records of a zone outside of the passed
+        zones are left out.
+        :param records:
+        :param zone_column: Column of the record zone.
+        :param attributes: Columns of the category dimensions.
+        :param weights: Columns of the weights to total.
+        :param zones: The zone dimension, defaults to the sorted record zones.
+        :return:
+        """
+        zone_values = records[zone_column].to_numpy()
+        zones = pd.Index(np.unique(zone_values) if zones is None else zones)
+        categories = {}
+        codes = [zones.get_indexer(zone_values)]
+        for attribute in attributes:
+            column = records[attribute]
+            missing = column.isna().to_numpy()
+            present = pd.Index(np.sort(column.dropna().unique()))
+            categories[attribute] = present.append(pd.Index([np.nan])) if missing.any() else present
+            codes.append(np.where(missing, len(present), present.get_indexer(column.to_numpy())))
+
+        coordinates = np.stack(codes, axis=1)
+        valid = (coordinates >= 0).all(axis=1)
+        values = records[weights].to_numpy(dtype=np.float64)[valid]
+        return AggregationCube._aggregate(zones, categories, weights, coordinates[valid], values)
+
+    @staticmethod
+    def _aggregate(zones: pd.Index, categories: dict, weights: list, coordinates: np.ndarray, values: np.ndarray):
+        """
+        Sums values with identical coordinates into the cells of a new cube.
+        """
+        shape = [len(zones)] + [len(category_values) for category_values in categories.values()]
+        cells = np.ravel_multi_index(tuple(coordinates.T), shape) if len(coordinates) \
+            else np.zeros(0, dtype=np.int64)
+        occupied, inverse = np.unique(cells, return_inverse=True)
+        sums = np.empty((len(occupied), len(weights)), dtype=np.float64)
+        for index in range(len(weights)):
+            sums[:, index] = zone_category_sums(inverse, np.zeros(len(inverse), dtype=np.int64), values[:, index],
+                                                len(occupied), 1)[:, 0]
+        coordinates = np.stack(np.unravel_index(occupied, shape), axis=1) if len(occupied) \
+            else np.zeros((0, len(shape)), dtype=np.int64)
+        return AggregationCube(zones, categories, weights, coordinates, sums)
+
+    def _selection_mask(self, zones=None, **selection) -> np.ndarray:
+        """
+        Evaluates which cells match the selection. Each selection value is a single category, a list
+        of categories or a function of the category index returning a boolean mask.
+        """
+        mask = np.ones(len(self._coordinates), dtype=bool)
+        if zones is not None:
+            mask &= np.isin(self._coordinates[:, 0], self._zones.get_indexer(pd.Index(zones)))
+        for attribute, value in selection.items():
+            categories = self._categories[attribute]
+            if callable(value):
+                selected = np.asarray(value(categories), dtype=bool)
+            elif np.ndim(value) == 0:
+                selected = np.asarray(categories == value, dtype=bool)
+            else:
+                selected = np.asarray(categories.isin(value), dtype=bool)
+            mask &= selected[self._coordinates[:, 1 + self.attributes.index(attribute)]]
+        return mask
+
+    def select(self, zones=None, **selection):
+        """
+        Returns the cube restricted to the cells of the passed zones and attribute categories.
+        :param zones: Zone ids to keep, all zones if None.
+        :param selection: Attribute categories to keep, see _selection_mask.
+        :return:
+        """
+        mask = self._selection_mask(zones, **selection)
+        return AggregationCube(self._zones, self._categories, self._weights, self._coordinates[mask],
+                               self._values[mask])
+
+    def total(self, weight: str = None, zones=None, **selection) -> float:
+        """
+        Returns the weighted total of the selected cells.
+        :param weight: Weight column, the first weight if None.
+        :param zones: Zone ids to include, all zones if None.
+        :param selection: Attribute categories to include, see _selection_mask.
+        :return:
+        """
+        column = self._weights.index(weight) if weight is not None else 0
+        return self._values[self._selection_mask(zones, **selection), column].sum()
+
+    def marginal(self, attributes: list):
+        """
+        Sums the cube over every attribute not in the passed list.
+        :param attributes: Attributes to keep.
+        :return:
+        """
+        dimensions = [0] + [1 + self.attributes.index(attribute) for attribute in attributes]
+        return AggregationCube._aggregate(self._zones, {attribute: self._categories[attribute]
+                                                        for attribute in attributes},
+                                          self._weights, self._coordinates[:, dimensions], self._values)
+
+    def roll_up(self, mapping: pd.Series):
+        """
+        Aggregates the zone dimension to a coarser geography, such as PD, puma or region. Zones
+        missing from the mapping are left out.
+        :param mapping: Series mapping zone ids (index) to their group.
+        :return:
+        """
+        groups = pd.Index(np.sort(mapping.unique()))
+        zone_groups = groups.get_indexer(mapping.reindex(self._zones).to_numpy())
+        coordinates = self._coordinates.copy()
+        coordinates[:, 0] = zone_groups[coordinates[:, 0]]
+        valid = coordinates[:, 0] >= 0
+        return AggregationCube._aggregate(groups, self._categories, self._weights, coordinates[valid],
+                                          self._values[valid])
+
+    def series(self, attributes: list, weight: str = None, zone_name: str = 'Zone') -> pd.Series:
+        """
+        Returns the occupied cells of the marginal over the passed attributes as a series, indexed by
+        zone and attribute categories.
+        :param attributes:
+        :param weight: Weight column, the first weight if None.
+        :param zone_name: Name of the zone index level.
+        :return:
+        """
+        marginal = self.marginal(attributes)
+        column = self._weights.index(weight) if weight is not None else 0
+        index = pd.MultiIndex.from_arrays(
+            [self._zones.take(marginal._coordinates[:, 0])] +
+            [self._categories[attribute].take(marginal._coordinates[:, 1 + position])
+             for position, attribute in enumerate(attributes)],
+            names=[zone_name] + attributes) if attributes \
+            else pd.Index(self._zones.take(marginal._coordinates[:, 0]), name=zone_name)
+        return pd.Series(marginal._values[:, column], index=index, name=self._weights[column])
+
+    def save(self, path: str, sources: dict = None):
+        """
+        Writes the cube to a compressed numpy archive.
+        :param path:
+        :param sources: Signatures (see file_signatures) of the files the cube was aggregated from.
+        :return:
+        """
+        # plain (non object) arrays, so that the archive loads without pickle; missing categories are
+        # recorded by attribute, as text arrays cannot hold NaN
+        missing = [attribute for attribute, category_values in self._categories.items()
+                   if category_values.hasnans]
+        arrays = {f'categories_{index}': np.asarray(category_values.dropna().tolist())
+                  for index, category_values in enumerate(self._categories.values())}
+        np.savez_compressed(path, zones=np.asarray(self._zones.tolist()), coordinates=self._coordinates,
+                            values=self._values,
+                            metadata=np.array(json.dumps({'attributes': self.attributes,
+                                                          'weights': self._weights,
+                                                          'missing': missing,
+                                                          'sources': sources})),
+                            **arrays)
+
+    @staticmethod
+    def load(path: str):
+        """
+        Reads a cube written by save.
+        :param path:
+        :return:
+        """
+        with np.load(path, allow_pickle=False) as archive:
+            metadata = json.loads(str(archive['metadata']))
+            missing = metadata.get('missing', [])
+            categories = {attribute: list(archive[f'categories_{index}']) + [np.nan] if attribute in missing
+                          else archive[f'categories_{index}']
+                          for index, attribute in enumerate(metadata['attributes'])}
+            return AggregationCube(archive['zones'], categories, metadata['weights'], archive['coordinates'],
+                                   archive['values'])
+
+    @staticmethod
+    def saved_sources(path: str) -> dict:
+        """
+        Reads the signatures of the source files stored with a cube by save.
+        :param path:
+        :return: The source signatures, None if they were not stored.
+        """
+        with np.load(path, allow_pickle=False) as archive:
+            return json.loads(str(archive['metadata'])).get('sources')
@@ -0,0 +1,250 @@
+import numpy as np
+import pandas as pd
+
+from gtamodel_popsyn.constants import AGE_BINS, ROAMING_ZONE_ID
+from gtamodel_popsyn.gtamodel_popsyn_config import ZoneIndex
+from gtamodel_popsyn.util.zone_category_sums import zone_category_sums
+
+CONTROL_LEVELS = ['maz', 'taz', 'meta']
+
+"""
+Default control definitions, used when ControlDefinitions is not present in the configuration.
+Each definition is written to the levels listed (all levels if omitted), in the order defined here.
+"""
+DEFAULT_CONTROL_DEFINITIONS = \
+    [{'Name': f'S_{status}', 'Records': 'Persons', 'Attribute': 'StudentStatus', 'Operator': 'eq',
+      'Value': status, 'Weight': 'weightp'} for status in ['O', 'S', 'P']] + \
+    [{'Name': f'license_{license}', 'Records': 'Persons', 'Attribute': 'License', 'Operator': 'eq',
+      'Value': license, 'Weight': 'weightp', 'Levels': ['maz', 'taz']} for license in ['Y', 'N']] + \
+    [{'Name': f'E_{status}', 'Records': 'Persons', 'Attribute': 'EmploymentStatus', 'Operator': 'eq',
+      'Value': status, 'Weight': 'weightp'} for status in ['O', 'F', 'P', 'J', 'H']] + \
+    [{'Name': occupation, 'Records': 'Persons', 'Attribute': 'Occupation', 'Operator': 'eq',
+      'Value': occupation, 'Weight': 'weightp'} for occupation in ['P', 'G', 'S', 'M', 'O']] + \
+    [{'Name': f'age{age_bin.start}_{age_bin.stop}', 'Records': 'Persons', 'Attribute': 'Age', 'Operator': 'range',
+      'Value': [age_bin.start, age_bin.stop], 'Weight': 'weightp'} for age_bin in AGE_BINS] + \
+    [{'Name': f'hhsize{size}', 'Records': 'Households', 'Attribute': 'NumberOfPersons', 'Operator': 'eq',
+      'Value': size, 'Weight': 'weighth', 'Levels': ['maz', 'taz']} for size in [1, 2, 3]] + \
+    [{'Name': 'hhsize4p', 'Records': 'Households', 'Attribute': 'NumberOfPersons', 'Operator': 'gte',
+      'Value': 4, 'Weight': 'weighth', 'Levels': ['maz', 'taz']}] + \
+    [{'Name': f'income_class_{income_class}', 'Records': 'Households', 'Attribute': 'IncomeClass', 'Operator': 'eq',
+      'Value': income_class, 'Weight': 'weighth'} for income_class in range(1, 7)] + \
+    [{'Name': 'male', 'Records': 'Persons', 'Attribute': 'Sex', 'Operator': 'eq', 'Value': 'M', 'Weight': 'weightp'},
+     {'Name': 'female', 'Records': 'Persons', 'Attribute': 'Sex', 'Operator': 'eq', 'Value': 'F', 'Weight': 'weightp'},
+     {'Name': 'employment_zone_internal', 'Records': 'Persons', 'Attribute': 'EmploymentZone', 'Operator': 'zones',
+      'Value': 'internal', 'Weight': 'weightp'},
+     {'Name': 'employment_zone_external', 'Records': 'Persons', 'Attribute': 'EmploymentZone', 'Operator': 'zones',
+      'Value': 'external', 'Exclude': [ROAMING_ZONE_ID], 'Weight': 'weightp'},
+     {'Name': 'employment_zone_roaming', 'Records': 'Persons', 'Attribute': 'EmploymentZone', 'Operator': 'eq',
+      'Value': ROAMING_ZONE_ID, 'Weight': 'weightp'},
+     {'Name': 'employment_zone_0', 'Records': 'Persons', 'Attribute': 'EmploymentZone', 'Operator': 'eq',
+      'Value': 0, 'Weight': 'weightp'}]
+
+
+class ControlDefinition(object):
+    """
+    A single control column, defined as the weighted total of the household or person records whose
+    attribute satisfies an operator:
+
+        eq      attribute == Value
+        gte     attribute >= Value
+        lte     attribute <= Value
+        range   Value[0] <= attribute <= Value[1]
+        in      attribute is one of the Value list
+        zones   attribute is a zone id of the 'internal' or 'external' zone ranges
+
+    Values listed in the optional Exclude are removed from any operator.
+    """
+
+    OPERATORS = ['eq', 'gte', 'lte', 'range', 'in', 'zones']
+
+    RECORDS = ['Persons', 'Households']
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def records(self):
+        return self._records
+
+    @property
+    def attribute(self):
+        return self._attribute
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @property
+    def levels(self):
+        return self._levels
+
+    def __init__(self, definition: dict):
+        """
+
+        :param definition: The control definition as specified in the configuration.
+        """
+        self._name = definition['Name']
+        self._records = definition.get('Records', 'Persons')
+        self._attribute = definition['Attribute']
+        self._operator = definition['Operator']
+        self._value = definition.get('Value')
+        self._exclude = definition.get('Exclude', [])
+        self._weight = definition.get('Weight', 'weightp' if self._records == 'Persons' else 'weighth')
+        self._levels = definition.get('Levels', CONTROL_LEVELS)
+
+        if self._operator not in self.OPERATORS:
+            raise ValueError(f'Control {self._name}: unknown operator {self._operator}.')
+        if self._records not in self.RECORDS:
+            raise ValueError(f'Control {self._name}: records must be one of {self.RECORDS}.')
+        if set(self._levels) - set(CONTROL_LEVELS):
+            raise ValueError(f'Control {self._name}: levels must be within {CONTROL_LEVELS}.')
+        if self._operator == 'zones' and self._value not in ['internal', 'external']:
+            raise ValueError(f'Control {self._name}: zones value must be internal or external.')
+
+    def mask(self, records: pd.DataFrame, zone_index: ZoneIndex) -> np.ndarray:
+        """
+        Evaluates which records belong to this control.
+        :param records: The household or person records.
+        :param zone_index: Index of the internal and external zones.
+        :return: Boolean array, one entry per record.
+        """
+        attribute = records[self._attribute]
+        if self._operator == 'eq':
+            mask = attribute == self._value
+        elif self._operator == 'gte':
+            mask = attribute >= self._value
+        elif self._operator == 'lte':
+            mask = attribute <= self._value
+        elif self._operator == 'range':
+            mask = (attribute >= self._value[0]) & (attribute <= self._value[1])
+        elif self._operator == 'in':
+            mask = attribute.isin(self._value)
+        else:
+            mask = zone_index.is_internal(attribute) if self._value == 'internal' \
+                else zone_index.is_external(attribute)
+
+        if self._exclude:
+            mask = mask & ~attribute.isin(self._exclude)
+        return np.asarray(mask, dtype=bool)
+
+
+class ControlPlan(object):
+    """
+    Compiled aggregation plan for a set of control definitions. Definitions over the same records,
+    attribute and weight are evaluated together: their (mutually exclusive) masks are encoded as
+    integer categories and every zone x category total is computed in a single grouped aggregation.
+    """
+
+    @property
+    def definitions(self):
+        return self._definitions
+
+    @property
+    def columns(self):
+        return [definition.name for definition in self._definitions]
+
+    @staticmethod
+    def from_config(config: dict):
+        """
+        Builds the plan from the ControlDefinitions configuration (or the default definitions), leaving
+        out any control listed in DropControlColumns.
+        :param config:
+        :return:
+        """
+        drop_columns = config.get('DropControlColumns') or []
+        return ControlPlan([ControlDefinition(definition) for definition in
+                            config.get('ControlDefinitions', DEFAULT_CONTROL_DEFINITIONS)
+                            if definition['Name'] not in drop_columns])
+
+    def __init__(self, definitions: list):
+        """
+
+        :param definitions: List of ControlDefinition
+        """
+        names = [definition.name for definition in definitions]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f'Duplicate control definitions: {sorted(duplicates)}')
+
+        self._definitions = definitions
+        self._groups = {}
+        for definition in definitions:
+            self._groups.setdefault((definition.records, definition.attribute, definition.weight),
+                                    []).append(definition)
+
+    def level_columns(self, level: str) -> list:
+        """
+        Returns the control columns written to the passed geography level, in definition order.
+        :param level: One of maz, taz or meta.
+        :return:
+        """
+        return [definition.name for definition in self._definitions if level in definition.levels]
+
+    def execute(self, records: dict, zone_codes: dict, zone_count: int, zone_index: ZoneIndex) -> dict:
+        """
+        Computes the zonal weighted totals of every control in the plan.
+        :param records: Mapping of Persons / Households to their record frames.
+        :param zone_codes: Mapping of Persons / Households to the zone position of each record.
+        :param zone_count: Number of zones.
+        :param zone_index: Index of the internal and external zones.
+        :return: Mapping of control column name to an array of zonal totals.
+        """
+        totals = {}
+        for (record_type, attribute, weight), definitions in self._groups.items():
+            frame = records[record_type]
+            for dimension in self._pack(definitions, frame, zone_index):
+                category_codes = np.full(len(frame), -1, dtype=np.int64)
+                for code, (definition, mask) in enumerate(dimension):
+                    category_codes[mask] = code
+                sums = zone_category_sums(zone_codes[record_type], category_codes, frame[weight].to_numpy(),
+                                          zone_count, len(dimension))
+                for code, (definition, mask) in enumerate(dimension):
+                    totals[definition.name] = sums[:, code]
+        return totals
+
+    def zone_totals(self, households: pd.DataFrame, persons_households: pd.DataFrame,
+                    zone_index: ZoneIndex) -> pd.DataFrame:
+        """
+        Computes the population and household totals and every control in the plan for each zone
+        (HouseholdZone) of the passed records.
+        :param households: The household records (weighth).
+        :param persons_households: The joined person and household records (weightp).
+        :param zone_index: Index of the internal and external zones.
+        :return: Data frame of control totals indexed by zone.
+        """
+        zones = pd.Index(np.unique(np.concatenate([households['HouseholdZone'].to_numpy(),
+                                                   persons_households['HouseholdZone'].to_numpy()])),
+                         name='HouseholdZone')
+        totals = pd.DataFrame(index=zones)
+        totals['totpop'] = persons_households.groupby('HouseholdZone')['weightp'].sum()
+        totals['totalhh'] = households.groupby('HouseholdZone')['weighth'].sum()
+
+        columns = self.execute(
+            records={'Persons': persons_households, 'Households': households},
+            zone_codes={'Persons': zones.get_indexer(persons_households['HouseholdZone']),
+                        'Households': zones.get_indexer(households['HouseholdZone'])},
+            zone_count=len(zones),
+            zone_index=zone_index)
+        for column in self.columns:
+            totals[column] = columns[column]
+        return totals.fillna(0)
+
+    @staticmethod
+    def _pack(definitions: list, frame: pd.DataFrame, zone_index: ZoneIndex) -> list:
+        """
+        Packs definitions into dimensions of mutually exclusive masks, so that each dimension can be
+        encoded as a single integer category per record.
+        :return: List of dimensions, each a list of (definition, mask) pairs.
+        """
+        dimensions = []
+        for definition in definitions:
+            mask = definition.mask(frame, zone_index)
+            for dimension, covered in dimensions:
+                if not (covered & mask).any():
+                    dimension.append((definition, mask))
+                    covered |= mask
+                    break
+            else:
+                dimensions.append(([(definition, mask)], mask.copy()))
+        return [dimension for dimension, _ in dimensions]
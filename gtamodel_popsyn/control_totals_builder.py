@@ -1,10 +1,15 @@
+import os
 from io import TextIOWrapper
 from shutil import copyfile
 
+import numpy as np
 import pandas as pd
 from gtamodel_popsyn.constants import *
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.control_definitions import ControlPlan
 from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
+from gtamodel_popsyn.util.intermediate_store import write_intermediate
+from gtamodel_popsyn.util.zone_neighbours import ZoneNeighbours
 
 
 class ControlTotalsBuilder(GTAModelPopSynProcessor):
@@ -13,17 +18,9 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
     for the specified attributes across all levels of geography.
     """
 
-    @staticmethod
-    def _sum_column(group, column, value, weight='weighth'):
-        return group[group[column] == value][weight].sum()
-
-    @staticmethod
-    def _sum_column_gte(group, column, value, weight='weighth'):
-        return group[group[column] >= value][weight].sum()
-
-    @staticmethod
-    def _sum_column_range(group, column, value, value2, weight='weighth'):
-        return group[(group[column] >= value) & (group[column] <= value2)][weight].sum()
+    @property
+    def controls(self):
+        return self._controls
 
     def __init__(self, gtamodel_popsyn_instance):
         """
@@ -32,32 +29,10 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
         """
         GTAModelPopSynProcessor.__init__(self, gtamodel_popsyn_instance)
         self._zones = pd.DataFrame()
-        self._age_bin_columns = []
         self._population_vector = None
-        for age_bin in AGE_BINS:
-            self._age_bin_columns.append(f'age{age_bin.start}_{age_bin.stop}')
-
-        self._controls = pd.DataFrame(columns=['region',
-                                               'puma', 'taz', 'maz', 'totalhh', 'totpop', 'S_O', 'S_S', 'S_P',
-                                               'license_Y', 'license_N', 'E_O', 'E_F', 'E_P', 'E_J', 'E_H',
-                                               'P', 'G', 'S', 'M', 'O' +
-                                               'age65p', 'hhsize1', 'hhsize2', 'hhsize3', 'hhsize4p',
-                                               'income_class_1', 'income_class_2', 'income_class_3',
-                                               'income_class_4', 'income_class_5', 'income_class_6',
-                                               'male', 'female',
-                                               'employment_zone_internal',
-                                               'employment_zone_external',
-                                               'employment_zone_roaming'] + self._age_bin_columns)
-
-    def _process_household_total(self, hh_group):
-        """
-
-        :param hh_group:
-        :return:
-        """
-        self._controls['totalhh'] = hh_group.weighth.sum()
-
-        return
+        self._control_plan = ControlPlan.from_config(self._config)
+        self._controls = pd.DataFrame(columns=['region', 'puma', 'taz', 'maz', 'totalhh', 'totpop'] +
+                                              self._control_plan.columns)
 
     def apply_population_vector(self, maz_file: str, taz_file: str, meta_file: str,
                                 population_vector: TextIOWrapper):
@@ -65,14 +40,32 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
         Applies a population vector to an existing set of controls. Population and households
         and other control data existing in the config file are scaled by the population differences.
 
-        Where base year data is missing, a value will be generated from the averages of nearby
-        zones.
+        Where base year data is missing, a value will be generated from the average control shares
+        of the populated zones in the same PD, or of the nearest populated zones (see _control_shares).
+
+        If the population vector holds more than one population column, the controls of the first
+        column are returned (see apply_population_vectors).
         @param population_vector:
         @param maz_file:
         @param taz_file:
         @param meta_file:
         @return:
         """
+        control_sets = self.apply_population_vectors(maz_file, taz_file, meta_file, population_vector)
+        return next(iter(control_sets.values()))
+
+    def apply_population_vectors(self, maz_file: str, taz_file: str, meta_file: str,
+                                 population_vector: TextIOWrapper) -> dict:
+        """
+        Applies a wide population vector, a zone column followed by one population column per horizon
+        year or scenario, to an existing set of controls. The base controls are read, mapped to puma and
+        aggregated to PD once, and the controls of all horizons are scaled in a single batch.
+        @param maz_file:
+        @param taz_file:
+        @param meta_file:
+        @param population_vector:
+        @return: Mapping of each horizon (population column name) to its (maz, taz, meta) controls.
+        """
         maz: pd.DataFrame = pd.read_csv(maz_file)
         taz: pd.DataFrame = pd.read_csv(taz_file)
         meta: pd.DataFrame = pd.read_csv(meta_file)
@@ -83,19 +76,18 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
 
         totpop = self.popsyn_config.total_population_column_name
         totalhh = self.popsyn_config.total_households_column_name
+        control_columns = self.popsyn_config.person_control_columns + self.popsyn_config.household_control_columns
 
         maz['maz_index'] = maz['maz']
         taz['taz_index'] = taz['taz']
         maz.set_index('maz_index', inplace=True)
         taz.set_index('taz_index', inplace=True)
         popvec.set_index(popvec.columns[0], inplace=True)
+        popvec.columns = [str(c) for c in popvec.columns]
 
-        orig = maz.copy()
-
-        # merge zones and population vector to only include zones that exist in source controls
-        maz_merge = pd.merge(maz, popvec, left_index=True, right_index=True, how="outer").fillna(0)
-        taz = pd.merge(taz, popvec, left_index=True, right_index=True, how="outer").fillna(0)
-        maz = maz_merge
+        # extend the controls with the zones of the population vector
+        maz = maz.reindex(maz.index.union(popvec.index)).fillna(0)
+        taz = taz.reindex(taz.index.union(popvec.index)).fillna(0)
 
         maz.loc[maz['region'] == 0, 'region'] = 1
         maz.loc[maz['puma'] == 0, 'puma'] = 3
@@ -103,137 +95,155 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
         taz.loc[taz['region'] == 0, 'region'] = 1
         taz.loc[taz['puma'] == 0, 'puma'] = 3
 
-        maz_merge['maz'] = maz_merge.index
-        maz_merge['taz'] = maz_merge.index
+        maz['maz'] = maz.index
+        maz['taz'] = maz.index
         taz['maz'] = taz.index
         taz['taz'] = taz.index
 
-        controls_t1 = maz_merge[(maz_merge[totpop] > 0) & (maz_merge[maz_merge.columns[-1]] > 0)]
-        controls_t2 = maz_merge[(maz_merge[totpop] == 0) & (maz_merge[maz_merge.columns[-1]] > 0)]
-        controls_t3 = maz_merge[maz_merge[maz_merge.columns[-1]] == 0]
-
-        # calculate population ratio where valid data exists between two populations
-        ratio = controls_t1[controls_t1[controls_t1.columns[-1]] > 0][controls_t1.columns[-1]] / \
-                controls_t1[controls_t1[totpop] > 0][totpop]
-
-        # calculate mean values at PD level for possible missing base year data
-        # (0 population total)
-        maz_pd_group = orig.loc[controls_t1.index].groupby('puma')
-        maz_pd_total = orig.loc[controls_t1.index].groupby('puma')[totpop].sum()
-
-        for column in self.popsyn_config.person_control_columns:
-            if column not in maz.columns:
-                continue
-            maz.loc[ratio.index, column] = controls_t1.loc[ratio.index, column] * ratio
-            taz.loc[ratio.index, column] = controls_t1.loc[ratio.index, column] * ratio
-
-            # apply mean aggregate values for specified columns where base year is 0
-            column_ratio = (maz_pd_group[column].sum() / maz_pd_total)
-            for planning_district in maz_pd_total.index:
-                if planning_district == 0:
-                    continue
-                if column == totpop:
-                    maz.loc[controls_t2.index, column] = controls_t2.loc[controls_t2.index, controls_t2.columns[-1]]
-                    taz.loc[controls_t2.index, column] = controls_t2.loc[controls_t2.index, controls_t2.columns[-1]]
-                    continue
-
-                maz.loc[controls_t2.index, column] = column_ratio[planning_district] * maz.loc[
-                    controls_t2.index, totpop]
-                taz.loc[controls_t2.index, column] = column_ratio[planning_district] * maz.loc[
-                    controls_t2.index, totpop]
-
-            # zero out columns where new population is 0
-            maz.loc[controls_t3.index, column] = 0
-            taz.loc[controls_t3.index, column] = 0
-
-        for column in self.popsyn_config.household_control_columns:
-            if column not in maz.columns:
-                continue
-            maz.loc[ratio.index, column] = controls_t1.loc[ratio.index, column] * ratio
-            taz.loc[ratio.index, column] = controls_t1.loc[ratio.index, column] * ratio
-
-            # apply mean aggregate values where data is missing
-            column_ratio = (maz_pd_group[column].sum() / maz_pd_total)
-            for planning_district in maz_pd_total.index:
-                if planning_district == 0:
-                    continue
-                maz.loc[controls_t2.index, column] = column_ratio[planning_district] * maz.loc[
-                    controls_t2.index, totpop]
-                taz.loc[controls_t2.index, column] = column_ratio[planning_district] * maz.loc[
-                    controls_t2.index, totpop]
-
-            # zero out columns where new population is 0
-            maz.loc[controls_t3.index, column] = 0
-            taz.loc[controls_t3.index, column] = 0
-
-        # where no prior population data exists, calculate the household to population ratio
-
-        meta[totpop] = maz[totpop].sum()
-        meta[totalhh] = maz[totalhh].sum()
+        population = popvec.reindex(maz.index).fillna(0)
+        columns = [c for c in control_columns if c in maz.columns]
+        zone_shares = self._control_shares(maz[columns], maz[totpop])
+        scaled = self._scale_controls(maz[columns], maz[totpop], population, zone_shares)
 
         # remove unused columns for control file clarity
-        maz.drop(set(maz.columns) - set(
-            ['region', 'puma', 'taz', 'maz'] +
-            self.popsyn_config.person_control_columns +
-            self.popsyn_config.household_control_columns), axis=1, inplace=True)
-        # remove unused taz control columns
-        taz.drop(set(taz.columns) - set(
-            ['region', 'puma', 'taz'] +
-            self.popsyn_config.person_control_columns +
-            self.popsyn_config.household_control_columns), axis=1, inplace=True)
-
-        import numpy as np
-        maz = maz.apply(np.ceil).astype(int)
-        taz = taz.apply(np.ceil).astype(int)
-        meta = meta.apply(np.ceil).astype(int)
-        return maz, taz, meta
+        maz = maz[[c for c in maz.columns if c in ['region', 'puma', 'taz', 'maz'] + control_columns]]
+        taz = taz[[c for c in taz.columns if c in ['region', 'puma', 'taz'] + control_columns]]
+        taz_zones = taz.index.intersection(maz.index)
+        taz_columns = [c for c in columns if c in taz.columns]
+
+        control_sets = {}
+        for index, horizon in enumerate(population.columns):
+            maz_horizon = maz.copy()
+            maz_horizon[columns] = scaled[index]
+            taz_horizon = taz.copy()
+            taz_horizon.loc[taz_zones, taz_columns] = maz_horizon.loc[taz_zones, taz_columns]
+            meta_horizon = meta.copy()
+            meta_horizon[totpop] = maz_horizon[totpop].sum()
+            meta_horizon[totalhh] = maz_horizon[totalhh].sum()
+
+            control_sets[horizon] = (maz_horizon.apply(np.ceil).astype(int),
+                                     taz_horizon.apply(np.ceil).astype(int),
+                                     meta_horizon.apply(np.ceil).astype(int))
+        return control_sets
+
+    def write_control_sets(self, control_sets: dict):
+        """
+        Writes the controls of each horizon to its own folder, Inputs/<horizon>/, using the configured
+        control file names.
+        @param control_sets: Mapping of horizon to (maz, taz, meta) controls.
+        @return:
+        """
+        for horizon, (maz, taz, meta) in control_sets.items():
+            os.makedirs(f'{self._output_path}/Inputs/{horizon}/', exist_ok=True)
+            maz.to_csv(f"{self._output_path}/Inputs/{horizon}/{self._config['MazLevelControls']}", index=False)
+            taz.to_csv(f"{self._output_path}/Inputs/{horizon}/{self._config['TazLevelControls']}", index=False)
+            meta.to_csv(f"{self._output_path}/Inputs/{horizon}/{self._config['MetaLevelControls']}", index=False)
+        return
 
-    def _map_control_puma_values(self, maz: pd.DataFrame, taz: pd.DataFrame):
-        pd_ranges = []
-        for r in self._config['PdGroups']:
-            pd_ranges.append(range(r[0], r[1]))
+    def _control_shares(self, controls: pd.DataFrame, base_population: pd.Series) -> np.ndarray:
+        """
+        Computes the control shares (control value per person) used to impute zones without a base
+        population. The shares are those of the populated zones in the zone's PD, or with
+        PopulationVectorImputation set to nearest, of the population weighted k (ImputationNeighbours)
+        nearest populated zones. Zones without a PD or coordinates use the region wide shares.
+        :param controls: The base control columns, indexed by zone.
+        :param base_population: The base year total population of each zone.
+        :return: A zones x columns array of control shares.
+        """
+        populated = (base_population > 0).to_numpy()
+        region_shares = controls[populated].sum() / base_population[populated].sum()
+
+        planning_districts = self.popsyn_config.zone_pd_map['PD'].reindex(controls.index)
+        shares = controls[populated].groupby(planning_districts[populated]).sum().div(
+            base_population[populated].groupby(planning_districts[populated]).sum(), axis=0)
+        zone_shares = shares.reindex(planning_districts).fillna(region_shares).to_numpy(dtype=float)
+
+        if self._config.get('PopulationVectorImputation', 'pd') == 'nearest':
+            coordinates = self.popsyn_config.zone_coordinates.reindex(controls.index)
+            located = coordinates.notna().all(axis=1).to_numpy()
+            sources = populated & located
+            targets = ~populated & located
+            if sources.any() and targets.any():
+                neighbours = ZoneNeighbours(coordinates[sources].to_numpy()).query(
+                    coordinates[targets].to_numpy(), self._config.get('ImputationNeighbours', 5))
+                # population weighted mean of the neighbour shares: sum of controls / sum of population
+                source_values = controls[sources].to_numpy(dtype=float)
+                source_population = base_population[sources].to_numpy(dtype=float)
+                zone_shares[targets] = source_values[neighbours].sum(axis=1) / \
+                    source_population[neighbours].sum(axis=1)[:, None]
+        return zone_shares
+
+    @staticmethod
+    def _scale_controls(controls: pd.DataFrame, base_population: pd.Series, population: pd.DataFrame,
+                        zone_shares: np.ndarray) -> np.ndarray:
+        """
+        Scales all control columns to the population of every horizon as a single matrix operation.
+        Zones with a base and new population (t1) are scaled by their population ratio. Zones with no
+        base population (t2) are imputed from their control shares multiplied by the new population.
+        Zones without a new population (t3) are zeroed.
+        :param controls: The base control columns, indexed by zone.
+        :param base_population: The base year total population of each zone.
+        :param population: The new population of each zone, one column per horizon.
+        :param zone_shares: The imputation control shares of each zone.
+        :return: A horizons x zones x columns array of scaled controls.
+        """
+        values = controls.to_numpy(dtype=float)
+        base = base_population.to_numpy(dtype=float)
+        horizons = population.to_numpy(dtype=float).T
+
+        populated = base > 0
+        t1 = populated & (horizons > 0)
+        t2 = (base == 0) & (horizons > 0)
 
+        ratio = np.divide(horizons, base, out=np.zeros_like(horizons), where=populated)
+        return np.where(t1[:, :, None], values * ratio[:, :, None],
+                        np.where(t2[:, :, None], zone_shares * horizons[:, :, None], 0.0))
+
+    def _map_control_puma_values(self, maz: pd.DataFrame, taz: pd.DataFrame):
         maz = maz.merge(self.popsyn_config.zone_pd_map, left_on="maz", right_index=True)
         taz = taz.merge(self.popsyn_config.zone_pd_map, left_on="taz", right_index=True)
 
-        for index, pd_range in enumerate(pd_ranges):
-            maz.loc[maz['PD'].between(pd_range.start, pd_range.stop, inclusive=True), ['puma']] = index + 1
-            taz.loc[taz['PD'].between(pd_range.start, pd_range.stop, inclusive=True), ['puma']] = index + 1
+        # zones of a PD outside of the PdGroups keep their puma
+        for controls, column in [(maz, 'maz'), (taz, 'taz')]:
+            pumas = self.popsyn_config.zone_index.zone_pumas(controls[column])
+            controls['puma'] = np.where(pumas > 0, pumas, controls['puma']) if 'puma' in controls else pumas
         return (maz, taz)
 
-    def _process_population_total(self, persons_group):
+    def _process_population_total(self, totals: pd.DataFrame):
         """
         Processes the total population for the controls. Will use a population vector if it was supplied
         by the user, otherwise the population total is calculated from the input data.
-        :param persons_group:
+        :param totals: The zonal control totals of the input data.
         :return:
         """
         if self._population_vector is None:
-            self._controls['totpop'] = persons_group.weightp.sum()
+            self._controls['totpop'] = totals['totpop']
         else:
             self._controls['totpop'] = self._population_vector['Population']
 
         return
 
-    def _find_missing(self, lst):
-        return [x for x in range(lst[0], lst[-1] + 1)
-                if x not in lst]
+    @property
+    def control_plan(self):
+        return self._control_plan
 
-    def build_control_totals(self, households, persons_households, zones):
+    def build_control_totals(self, households, persons_households, zones, totals: pd.DataFrame = None):
         """
         Builds control totals for all levels of geography
         :param households:
         :param persons_households:
         :param zones:
+        :param totals: Zonal control totals already computed from the records (see ControlPlan.zone_totals),
+        computed here when not passed.
         :return:
         """
 
-        self._zones = zones[zones['Zone'].isin(self.popsyn_config.internal_zone_range)]
-
-        hh2_group = households.groupby(['HouseholdZone'])
-        hh_group = persons_households.groupby(['HouseholdZone'])
+        self._zones = zones[self.popsyn_config.zone_index.is_internal(zones['Zone'])]
 
-        # zones_empty = self._find_missing(self._zones['Zone#'].to_list())
+        if totals is None:
+            totals = self._control_plan.zone_totals(
+                households, persons_households,
+                zone_index=self.popsyn_config.zone_index)
 
         self._controls['maz'] = self._zones['Zone']
         self._controls['puma'] = 0
@@ -242,162 +252,69 @@ class ControlTotalsBuilder(GTAModelPopSynProcessor):
         self._zones = self._zones.set_index('Zone')
         self._controls['region'] = 1
 
-        self._process_population_total(hh_group)
-        self._process_household_total(hh2_group)
-
+        self._process_population_total(totals)
+        self._controls['totalhh'] = totals['totalhh']
         self._controls['puma'] = (self._zones['puma'].astype(int))
-        self._controls['male'] = hh_group.apply(lambda x: self._sum_column(x, 'Sex', 'M', 'weightp'))
-        self._controls['female'] = \
-            hh_group.apply(lambda x: self._sum_column(x, 'Sex', 'F', 'weightp'))
-
-        self._controls['employment_zone_internal'] = \
-            hh_group.apply(lambda x: x[x.EmploymentZone.isin(self.popsyn_config.internal_zone_range)]['weightp'].sum())
-        self._controls['employment_zone_roaming'] = \
-            hh_group.apply(lambda x: x[x.EmploymentZone == ROAMING_ZONE_ID]['weightp'].sum())
-        self._controls['employment_zone_external'] = \
-            hh_group.apply(
-                lambda x: x.loc[(x.EmploymentZone.isin(self.popsyn_config.external_zone_range)) &
-                                (x.EmploymentZone != ROAMING_ZONE_ID), 'weightp'].sum())
-        self._controls['employment_zone_0'] = \
-            hh_group.apply(
-                lambda x: x.loc[(x.EmploymentZone == 0), 'weightp'].sum())
-
-        self._controls['income_class_1'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 1, 'weighth'))
-        self._controls['income_class_2'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 2, 'weighth'))
-        self._controls['income_class_3'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 3, 'weighth'))
-        self._controls['income_class_4'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 4, 'weighth'))
-        self._controls['income_class_5'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 5, 'weighth'))
-        self._controls['income_class_6'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'IncomeClass', 6, 'weighth'))
-
-        self._controls['hhsize1'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'NumberOfPersons', 1, 'weighth'))
-        self._controls['hhsize2'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'NumberOfPersons', 2, 'weighth'))
-        self._controls['hhsize3'] = hh2_group.apply(
-            lambda x: self._sum_column(x, 'NumberOfPersons', 3, 'weighth'))
-        self._controls['hhsize4p'] = hh2_group.apply(
-            lambda x: self._sum_column_gte(x, 'NumberOfPersons', 4, 'weighth'))
-
-        for index, age_bin in enumerate(self._age_bin_columns):
-            self._controls[age_bin] = hh_group.apply(
-                lambda x: self._sum_column_range(x, 'Age', AGE_BINS[index].start, AGE_BINS[index].stop,
-                                                 'weightp'))
-        self._controls['E_J'] = hh_group.apply(
-            lambda x: self._sum_column(x, 'EmploymentStatus', 'J', 'weightp'))
-        self._controls['E_P'] = hh_group.apply(
-            lambda x: self._sum_column(x, 'EmploymentStatus', 'P', 'weightp'))
-        self._controls['E_F'] = hh_group.apply(
-            lambda x: self._sum_column(x, 'EmploymentStatus', 'F', 'weightp'))
-        self._controls['E_O'] = hh_group.apply(
-            lambda x: self._sum_column(x, 'EmploymentStatus', 'O', 'weightp'))
-        self._controls['E_H'] = hh_group.apply(
-            lambda x: self._sum_column(x, 'EmploymentStatus', 'H', 'weightp'))
-
-        self._controls['P'] = hh_group.apply(lambda x: self._sum_column(x, 'Occupation', 'P', 'weightp'))
-        self._controls['G'] = hh_group.apply(lambda x: self._sum_column(x, 'Occupation', 'G', 'weightp'))
-        self._controls['S'] = hh_group.apply(lambda x: self._sum_column(x, 'Occupation', 'S', 'weightp'))
-        self._controls['M'] = hh_group.apply(lambda x: self._sum_column(x, 'Occupation', 'M', 'weightp'))
-        self._controls['O'] = hh_group.apply(lambda x: self._sum_column(x, 'Occupation', 'O', 'weightp'))
-
-        self._controls['license_Y'] = hh_group.apply(lambda x: self._sum_column(x, 'License', 'Y', 'weightp'))
-        self._controls['license_N'] = hh_group.apply(lambda x: self._sum_column(x, 'License', 'N', 'weightp'))
-        self._controls['S_O'] = hh_group.apply(lambda x: self._sum_column(x, 'StudentStatus', 'O', 'weightp'))
-        self._controls['S_S'] = hh_group.apply(lambda x: self._sum_column(x, 'StudentStatus', 'S', 'weightp'))
-        self._controls['S_P'] = hh_group.apply(lambda x: self._sum_column(x, 'StudentStatus', 'P', 'weightp'))
+
+        for column in self._control_plan.columns:
+            self._controls[column] = totals[column]
 
         self._controls = self._controls.fillna(0)
         self._write_maz_control_totals_file()
-        taz_controls = self._write_taz_control_totals_file()
-        self._write_meta_control_totals_file(taz_controls)
+        self._write_taz_control_totals_file()
+        self._write_meta_control_totals_file()
 
         return
 
+    def _level_columns(self, level: str) -> list:
+        """
+        Returns the control columns written to the passed geography level. The population and household
+        totals are always written unless explicitly dropped.
+        :param level:
+        :return:
+        """
+        drop_columns = self._config.get('DropControlColumns') or []
+        return [c for c in ['totalhh', 'totpop'] if c not in drop_columns] + self._control_plan.level_columns(level)
+
     def _write_maz_control_totals_file(self):
         """
 
         :return:
         """
-        maz_controls = self._controls.reset_index()[
-            (['region', 'puma', 'taz', 'maz', 'totalhh', 'totpop', 'S_O', 'S_S', 'S_P',
-              'license_Y', 'license_N', 'E_O', 'E_F', 'E_P', 'E_J', 'E_H', 'P',
-              'G',
-              'S', 'M', 'O'] + self._age_bin_columns +
-             ['hhsize1', 'hhsize2', 'hhsize3', 'hhsize4p',
-              'income_class_1',
-              'income_class_2',
-              'income_class_3',
-              'income_class_4',
-              'income_class_5',
-              'income_class_6',
-              'male',
-              'female',
-              'employment_zone_internal',
-              'employment_zone_external',
-              'employment_zone_roaming',
-              'employment_zone_0'
-              ])].sort_values(['puma', 'taz', 'maz'])
-
-        if self._config['DropControlColumns']:
-            maz_controls = maz_controls.drop(self._config['DropControlColumns'], axis=1)
-
-        maz_controls.astype(int).to_csv(
-            f"{self._output_path}/Inputs/{self._config['MazLevelControls']}", index=False)
+        maz_controls = self._controls.reset_index()[['region', 'puma', 'taz', 'maz'] +
+                                                    self._level_columns('maz')].sort_values(['puma', 'taz', 'maz'])
+
+        self._write_control_totals(maz_controls.astype(int), self._config['MazLevelControls'])
 
     def _write_taz_control_totals_file(self):
         """
 
         :return:
         """
-        controls_taz = self._controls.reset_index()[(['region',
-                                                      'puma', 'taz', 'totalhh', 'totpop', 'S_O', 'S_S', 'S_P',
-                                                      'license_Y', 'license_N', 'E_O', 'E_F', 'E_P', 'E_J', 'E_H',
-                                                      'P', 'G', 'S', 'M', 'O'] +
-                                                     self._age_bin_columns +
-                                                     ['hhsize1', 'hhsize2', 'hhsize3', 'hhsize4p',
-                                                      'income_class_1', 'income_class_2', 'income_class_3',
-                                                      'income_class_4', 'income_class_5', 'income_class_6',
-                                                      'male', 'female',
-                                                      'employment_zone_internal',
-                                                      'employment_zone_external',
-                                                      'employment_zone_roaming',
-                                                      'employment_zone_0'])].sort_values(['puma', 'taz'])
-
-        if self._config['DropControlColumns']:
-            controls_taz = controls_taz.drop(self._config['DropControlColumns'], axis=1)
-
-        controls_taz.astype(int).to_csv(
-            f"{self._output_path}/Inputs/{self._config['TazLevelControls']}", index=False)
-
-        return controls_taz
-
-    def _write_meta_control_totals_file(self, taz_controls):
+        controls_taz = self._controls.reset_index()[['region', 'puma', 'taz'] +
+                                                    self._level_columns('taz')].sort_values(['puma', 'taz'])
+
+        self._write_control_totals(controls_taz.astype(int), self._config['TazLevelControls'])
+
+    def _write_meta_control_totals_file(self):
+        """
+        Writes the meta level controls, totalled by region from the zone controls so that they do not
+        depend on the columns written to the other levels.
+        :return:
+        """
+        meta_controls = self._controls.groupby('region')[self._level_columns('meta')].sum().reset_index()
+
+        self._write_control_totals(meta_controls.astype(int), self._config['MetaLevelControls'])
+
+    def _write_control_totals(self, controls: pd.DataFrame, file_name: str):
         """
-        
-        :param taz_controls: The taz level controls, used as base to generate meta level controls.
-        :return: 
+        Writes a control totals file to the Inputs folder as CSV, and also in the configured
+        IntermediateFormat when that is a columnar format.
+        :param controls:
+        :param file_name:
+        :return:
         """
-        meta_controls = taz_controls.groupby(['region'])[(['totalhh', 'totpop', 'S_O', 'S_S', 'S_P',
-                                                           'P', 'G', 'S', 'M', 'O'] +
-                                                          self._age_bin_columns + [
-                                                              'E_O', 'E_F', 'E_P', 'E_J', 'E_H',
-                                                              'income_class_1',
-                                                              'income_class_2',
-                                                              'income_class_3',
-                                                              'income_class_4',
-                                                              'income_class_5',
-                                                              'income_class_6',
-                                                              'male',
-                                                              'female',
-                                                              'employment_zone_internal',
-                                                              'employment_zone_external',
-                                                              'employment_zone_roaming',
-                                                              'employment_zone_0'])].apply(sum).drop(
-            self._config['DropControlColumns'], axis=1).reset_index()
-
-        meta_controls.astype(int).to_csv(f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}", index=False)
+        path = f"{self._output_path}/Inputs/{file_name}"
+        controls.to_csv(path, index=False)
+        if self._config.get('IntermediateFormat', 'csv') != 'csv':
+            write_intermediate(controls, path, self._config['IntermediateFormat'])
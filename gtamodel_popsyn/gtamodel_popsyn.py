@@ -4,6 +4,7 @@ import subprocess
 from io import TextIOWrapper
 
 from logzero import setup_logger
+from gtamodel_popsyn._database_engine import DatabaseEngine
 from gtamodel_popsyn._database_processor import DatabaseProcessor
 from gtamodel_popsyn.control_totals_builder import ControlTotalsBuilder
 from gtamodel_popsyn.gtamodel_popsyn_config import GTAModelPopSynConfig
@@ -11,6 +12,7 @@ from gtamodel_popsyn.input_processor import InputProcessor
 from gtamodel_popsyn.output_processor import OutputProcessor
 from gtamodel_popsyn.validation_report import ValidationReport
 from gtamodel_popsyn._settings_processor import SettingsProcessor
+from gtamodel_popsyn._slice_population import PopulationSlicer
 
 
 class GTAModelPopSyn(object):
@@ -43,6 +45,10 @@ class GTAModelPopSyn(object):
     def columns(self):
         return self._columns
 
+    @property
+    def database(self):
+        return self._database
+
     def __init__(self, config, arguments, start_time=datetime.datetime.now(), name=None, output_path=None,
                  make_output=True,
                  percent_populations: list = None, population_vector: TextIOWrapper = None):
@@ -58,6 +64,7 @@ class GTAModelPopSyn(object):
         self._name = name
         self._population_vector = population_vector
         self._columns = []
+        self._database = DatabaseEngine(config)
 
         if percent_populations is None:
             self._percent_populations = [1.0]
@@ -70,24 +77,28 @@ class GTAModelPopSyn(object):
                     f'{start_time:%Y-%m-%d_%H-%M}_{percent_population}/',
                     exist_ok=True)
 
-            self._arguments = arguments
-            self._output_path = f'{self._config["OutputFolder"]}/{(self._name + "_") if name else ""}' \
-                                f'{self._start_time:%Y-%m-%d_%H-%M}_' \
-                                f'{percent_population}' if output_path is None else output_path
-            self._logger = setup_logger(name='gtamodel', logfile=f'{self._output_path}/gtamodel_popsyn.log')
-            self._logger.info(f'GTAModel PopSyn')
-            self._popsyn_config = GTAModelPopSynConfig(self)
-            self._popsyn_config.initialize()
-            self._summary_report = ValidationReport(self)
-            self._summary_report.popsyn_config = self._popsyn_config
-            self._control_totals_builder = ControlTotalsBuilder(self)
-            self._control_totals_builder.popsyn_config = self._popsyn_config
-            self._input_processor = InputProcessor(self, self._control_totals_builder)
-            self._input_processor.popsyn_config = self._popsyn_config
-            self._output_processor = OutputProcessor(self, percent_population)
-            self._output_processor.popsyn_config = self._popsyn_config
-            self._database_processor = DatabaseProcessor(self, percent_population)
-            self._settings_processor = SettingsProcessor(self)
+        # the processors (and their database sessions) are built once, for the last percent population
+        percent_population = self._percent_populations[-1]
+        self._arguments = arguments
+        self._output_path = f'{self._config["OutputFolder"]}/{(self._name + "_") if name else ""}' \
+                            f'{self._start_time:%Y-%m-%d_%H-%M}_' \
+                            f'{percent_population}' if output_path is None else output_path
+        self._logger = setup_logger(name='gtamodel', logfile=f'{self._output_path}/gtamodel_popsyn.log')
+        self._logger.info(f'GTAModel PopSyn')
+        self._popsyn_config = GTAModelPopSynConfig(self)
+        self._popsyn_config.initialize()
+        self._summary_report = ValidationReport(self)
+        self._summary_report.popsyn_config = self._popsyn_config
+        self._control_totals_builder = ControlTotalsBuilder(self)
+        self._control_totals_builder.popsyn_config = self._popsyn_config
+        self._input_processor = InputProcessor(self, self._control_totals_builder)
+        self._input_processor.popsyn_config = self._popsyn_config
+        self._output_processor = OutputProcessor(self, percent_population)
+        self._output_processor.popsyn_config = self._popsyn_config
+        self._database_processor = DatabaseProcessor(self, percent_population)
+        self._database_processor.popsyn_config = self._popsyn_config
+        self._settings_processor = SettingsProcessor(self)
+        self._population_slicer = PopulationSlicer(self)
 
         os.makedirs(f'{self._output_path}/Inputs/', exist_ok=True)
         self._popsyn_config = GTAModelPopSynConfig(self)
@@ -119,6 +130,17 @@ class GTAModelPopSyn(object):
         self._output_processor.generate_outputs(use_saved, merge_outputs)
         self._logger.info('Output generation has completed processing')
 
+    def slice_population(self, fraction: float):
+        """
+        Writes a zone stratified slice (sample) of the synthesized population in the output folder, with
+        expansion factors scaled to preserve the zonal household totals.
+        @param fraction: The fraction of the households of each zone to keep.
+        @return:
+        """
+        slice_folder = self._population_slicer.slice(fraction)
+        self._logger.info(f'Population slice has been written to {slice_folder}.')
+        return
+
     def _copy_config_files(self):
         import json
         with open(self._output_path + '/config.json', 'w') as outfile:
@@ -128,7 +150,8 @@ class GTAModelPopSyn(object):
         """
         Initializes the database using control totals passed from an already existing set of files.
         If a population vector is also used in the procedure, it will be applied before the controls
-        are moved to to the database.
+        are moved to to the database. A population vector with several horizon columns has the controls
+        of every horizon written to Inputs/<horizon>/, and the first horizon is used for this run.
         @param maz_file:
         @param taz_file:
         @param meta_file:
@@ -140,8 +163,14 @@ class GTAModelPopSyn(object):
         if self._population_vector is not None:
             # apply forecast / population vector changes in place
             self._logger.info('Applying population vector to control totals.')
-            (maz, taz, meta) = self._control_totals_builder.apply_population_vector(
+            control_sets = self._control_totals_builder.apply_population_vectors(
                 maz_file, taz_file, meta_file, self._population_vector)
+            if len(control_sets) > 1:
+                # every horizon is written, the first one is synthesized in this run
+                self._control_totals_builder.write_control_sets(control_sets)
+                self._logger.info(f'Controls for horizons {list(control_sets)} written to {self._output_path}/Inputs/. '
+                                  f'Synthesizing horizon {next(iter(control_sets))}.')
+            (maz, taz, meta) = next(iter(control_sets.values()))
             self._database_processor.initialize_database_with_existing_controls(maz, taz, meta)
         else:
             self._database_processor.initialize_database_with_control_files(maz_file, taz_file, meta_file, gen_puma)
@@ -176,7 +205,7 @@ class GTAModelPopSyn(object):
         and output generation will be performed.
         :return:
         """
-        self.generate_inputs(True)
+        self.generate_inputs(True, gen_pumas=bool(getattr(self._arguments, 'generate_pumas', False)))
         self.initialize_database(
             self._input_processor.processed_persons,
             self._input_processor.processed_households)
@@ -184,13 +213,15 @@ class GTAModelPopSyn(object):
         self.generate_outputs(use_saved=False)
         self.generate_summary_report()
 
-    def generate_inputs(self, build_controls: bool = True):
+    def generate_inputs(self, build_controls: bool = True, gen_pumas: bool = False):
         """
         Generates all inputs required for the popsyn3 procedure.
+        :param build_controls:
+        :param gen_pumas: Generate balanced pumas instead of using PdGroups.
         :return:
         """
         self._logger.info(f'Processing input data.')
-        self._input_processor.generate(build_controls)
+        self._input_processor.generate(build_controls, gen_pumas)
         self._logger.info(f'Input data has completed processing.')
         return
 
@@ -1,11 +1,176 @@
 import json
 
+import numpy as np
+
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
-from gtamodel_popsyn.constants import INTERNAL_ZONE_RANGE, EXTERNAL_ZONE_RANGE
+from gtamodel_popsyn.constants import INTERNAL_ZONE_RANGE, EXTERNAL_ZONE_RANGE, ROAMING_ZONE_ID
 from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
+from gtamodel_popsyn.util.partition_pumas import partition_pumas, partition_balance
 import pandas as pd
 
 
+class PumaMapping(object):
+    """
+    Compiled PD -> puma mapping of the PdGroups configuration. Each group is a closed [first, last]
+    range of PDs, the i-th group forming puma i + 1. The groups are sorted into an array of breakpoints
+    (their first PDs), so that the pumas of any number of PDs are found with a single searchsorted.
+
+    A PD shared by the last PD of a group and the first PD of the next group belongs to the next group,
+    PDs outside of every group map to puma 0, and groups overlapping by more than one PD are rejected.
+    """
+
+    @property
+    def puma_count(self):
+        return len(self._pumas)
+
+    def __init__(self, pd_groups: list = None):
+        """
+
+        @param pd_groups: List of [first, last] PD ranges.
+        """
+        groups = np.asarray(pd_groups or [], dtype=np.int64).reshape(-1, 2)
+        if (groups[:, 1] < groups[:, 0]).any():
+            raise ValueError(f'PdGroups ranges must be [first, last] with first <= last: {groups.tolist()}')
+
+        order = np.argsort(groups[:, 0], kind='stable')
+        self._starts = groups[order, 0]
+        self._ends = groups[order, 1]
+        self._pumas = order + 1
+
+        overlapping = np.flatnonzero(self._starts[1:] < self._ends[:-1])
+        if len(overlapping):
+            raise ValueError(f'PdGroups ranges overlap: {groups[order[overlapping]].tolist()} and '
+                             f'{groups[order[overlapping + 1]].tolist()}')
+
+    def pumas(self, pds) -> np.ndarray:
+        """
+        @param pds: PD values.
+        @return: The puma of each PD, 0 for PDs outside of the groups.
+        """
+        pds = np.asarray(pds, dtype=np.int64)
+        positions = np.searchsorted(self._starts, pds, side='right') - 1
+        inside = positions >= 0
+        inside[inside] = pds[inside] <= self._ends[positions[inside]]
+        return np.where(inside, self._pumas.take(positions, mode='clip') if len(self._pumas) else 0, 0)
+
+    def assign(self, frame: pd.DataFrame, pd_column: str = 'PD', puma_column: str = 'puma') -> pd.DataFrame:
+        """
+        Sets the puma column of a frame from its PD column.
+        @param frame:
+        @param pd_column:
+        @param puma_column:
+        @return: The frame.
+        """
+        frame[puma_column] = self.pumas(frame[pd_column])
+        return frame
+
+
+class ZoneIndex(object):
+    """
+    Array backed index of the zone system. Zone ids are used directly as positions in lookup arrays, so
+    that membership tests, zone classification and the zone -> PD -> puma mappings of any column of
+    zone ids are a single vectorized take. Ids outside of the index are not internal or external, are
+    classified as other and map to PD and puma 0.
+    """
+
+    ZONE_TYPES = ['internal', 'external', 'roaming', 'zero', 'other']
+
+    INTERNAL, EXTERNAL, ROAMING, ZERO, OTHER = range(len(ZONE_TYPES))
+
+    @property
+    def internal_zones(self):
+        return np.flatnonzero(self._internal)
+
+    @property
+    def external_zones(self):
+        return np.flatnonzero(self._external)
+
+    def __init__(self, internal_zones, external_zones, zone_pds: pd.Series, puma_mapping: PumaMapping = None,
+                 zone_pumas: pd.Series = None):
+        """
+
+        @param internal_zones: Ids of the internal zones.
+        @param external_zones: Ids of the external zones.
+        @param zone_pds: The PD of each zone, indexed by zone id.
+        @param puma_mapping: The PD -> puma mapping, every zone maps to puma 0 if None.
+        @param zone_pumas: The puma of each zone, indexed by zone id. Replaces the puma mapping if passed,
+        zones missing from it map to puma 0.
+        """
+        internal_zones = np.asarray(internal_zones, dtype=np.int64)
+        external_zones = np.asarray(external_zones, dtype=np.int64)
+        zone_ids = zone_pds.index.to_numpy(dtype=np.int64)
+        size = max(internal_zones.max(initial=0), external_zones.max(initial=0), zone_ids.max(initial=0),
+                   zone_pumas.index.max() if zone_pumas is not None and len(zone_pumas) else 0,
+                   ROAMING_ZONE_ID) + 1
+
+        self._internal = np.zeros(size, dtype=bool)
+        self._internal[internal_zones] = True
+        self._external = np.zeros(size, dtype=bool)
+        self._external[external_zones] = True
+
+        # precedence: roaming, internal, external, zero
+        self._zone_types = np.full(size, self.OTHER, dtype=np.int8)
+        self._zone_types[0] = self.ZERO
+        self._zone_types[external_zones] = self.EXTERNAL
+        self._zone_types[internal_zones] = self.INTERNAL
+        self._zone_types[ROAMING_ZONE_ID] = self.ROAMING
+
+        self._pds = np.zeros(size, dtype=np.int64)
+        self._pds[zone_ids] = zone_pds.to_numpy(dtype=np.int64)
+
+        if zone_pumas is None:
+            self._pumas = (puma_mapping or PumaMapping()).pumas(self._pds)
+        else:
+            self._pumas = np.zeros(size, dtype=np.int64)
+            self._pumas[zone_pumas.index.to_numpy(dtype=np.int64)] = zone_pumas.to_numpy(dtype=np.int64)
+
+    def _take(self, lookup: np.ndarray, zones, default) -> np.ndarray:
+        """
+        Looks up the values of zone ids, ids outside of the lookup array get the default.
+        """
+        zones = np.asarray(zones)
+        values = np.full(zones.shape, default, dtype=lookup.dtype)
+        inside = (zones >= 0) & (zones < len(lookup))
+        values[inside] = lookup[zones[inside].astype(np.int64)]
+        return values
+
+    def is_internal(self, zones) -> np.ndarray:
+        """
+        @param zones: Zone ids.
+        @return: Boolean array, True for the internal zones.
+        """
+        return self._take(self._internal, zones, False)
+
+    def is_external(self, zones) -> np.ndarray:
+        """
+        @param zones: Zone ids.
+        @return: Boolean array, True for the external zones.
+        """
+        return self._take(self._external, zones, False)
+
+    def classify(self, zones) -> np.ndarray:
+        """
+        Classifies zone ids as roaming, internal, external, zero or other (in that order of precedence).
+        @param zones: Zone ids.
+        @return: Array of positions in ZONE_TYPES.
+        """
+        return self._take(self._zone_types, zones, self.OTHER)
+
+    def zone_pds(self, zones) -> np.ndarray:
+        """
+        @param zones: Zone ids.
+        @return: The PD of each zone.
+        """
+        return self._take(self._pds, zones, 0)
+
+    def zone_pumas(self, zones) -> np.ndarray:
+        """
+        @param zones: Zone ids.
+        @return: The puma of each zone, 0 for zones of a PD outside of the PdGroups (see PumaMapping).
+        """
+        return self._take(self._pumas, zones, 0)
+
+
 class GTAModelPopSynConfig(GTAModelPopSynProcessor):
     """
     General configuration class for sharing information between sub components, with post processed data
@@ -36,20 +201,35 @@ class GTAModelPopSynConfig(GTAModelPopSynProcessor):
     def person_control_columns(self):
         return self._person_control_columns
 
+    @property
+    def puma_mapping(self):
+        return self._puma_mapping
+
+    @property
+    def zone_index(self):
+        return self._zone_index
+
     @property
     def zone_pd_map(self):
         return self._zones
 
+    @property
+    def zone_coordinates(self):
+        return self._zone_coordinates
+
     def __init__(self, gtamodel_popsyn_instance):
         super().__init__(gtamodel_popsyn_instance)
-        self._internal_zone_range: pd.Series = pd.Series()
-        self._external_zone_range: pd.Series = pd.Series()
+        self._internal_zone_range: pd.Series = pd.Series(dtype=np.int64)
+        self._external_zone_range: pd.Series = pd.Series(dtype=np.int64)
         self._total_population_column_name = self._config.get('TotalPopulationColumnName', False) or 'totpop'
         self._total_households_column_name = self._config.get('TotalHouseholdsColumnName', False) or 'totalhh'
 
         self._household_control_columns = self._config.get('HouseholdControlColumns', False) or ['totalhh']
         self._person_control_columns = self._config.get('PersonControlColumns', False) or ['totpop']
         self._zones = pd.DataFrame()
+        self._zone_coordinates = pd.DataFrame(columns=['X', 'Y'])
+        self._puma_mapping = PumaMapping()
+        self._zone_index = None
 
         self._process_zone_map()
 
@@ -72,6 +252,50 @@ class GTAModelPopSynConfig(GTAModelPopSynProcessor):
             external_zone_ranges = self._config['ExternalZoneRanges']
 
         self._external_zone_range = generate_zone_ranges(external_zone_ranges)
+        self._puma_mapping = PumaMapping(self._config.get('PdGroups'))
+        self._build_zone_index()
+
+    def _build_zone_index(self, zone_pumas: pd.Series = None):
+        """
+        Builds the zone index from the zone ranges, the zone map and the puma mapping.
+        @param zone_pumas: Generated puma of each zone, replacing the puma mapping.
+        """
+        self._zone_index = ZoneIndex(self._internal_zone_range, self._external_zone_range,
+                                     self._zones.drop_duplicates('Zone').set_index('Zone')['PD'],
+                                     self._puma_mapping, zone_pumas)
+
+    def generate_pumas(self, zone_weights: pd.Series, puma_count: int, respect_pds: bool = True) -> pd.DataFrame:
+        """
+        Replaces the PdGroups pumas with puma_count generated pumas of near equal weight. The internal
+        zones, in PD and zone order, are split into contiguous pumas (see partition_pumas). When respecting
+        PDs, whole PDs are assigned and the result is kept as the puma mapping of the generated PD groups.
+        @param zone_weights: Weight (population or seed households) of each zone, indexed by zone id.
+        @param puma_count: The number of pumas.
+        @param respect_pds: Whether the zones of a PD are kept in the same puma.
+        @return: The balance of the partition (see partition_balance), indexed by puma.
+        """
+        zones = self._zones.drop_duplicates('Zone')
+        zones = zones[self._zone_index.is_internal(zones['Zone'])]
+        weights = zone_weights.reindex(zones['Zone']).fillna(0).to_numpy(dtype=np.float64)
+
+        if respect_pds:
+            pd_weights = pd.Series(weights, index=zones['PD'].to_numpy()).groupby(level=0).sum()
+            pd_pumas = partition_pumas(pd_weights.to_numpy(), puma_count)
+            pd_groups = pd.Series(pd_weights.index, index=pd_pumas).groupby(level=0).agg(['min', 'max'])
+            self._puma_mapping = PumaMapping(pd_groups.to_numpy().tolist())
+            self._build_zone_index()
+            return partition_balance(pd_weights.to_numpy(), pd_pumas)
+
+        zone_pumas = partition_pumas(weights, puma_count)
+        self._build_zone_index(pd.Series(zone_pumas, index=zones['Zone'].to_numpy()))
+        return partition_balance(weights, zone_pumas)
+
+    def restore_pumas(self, zone_pumas: pd.Series):
+        """
+        Replaces the PdGroups pumas with pumas generated by a previous run (e.g. restored from the input cache).
+        @param zone_pumas: The generated puma of each zone, indexed by zone id.
+        """
+        self._build_zone_index(zone_pumas)
 
     def _process_zone_map(self):
         """
@@ -84,6 +308,11 @@ class GTAModelPopSynConfig(GTAModelPopSynProcessor):
         self._zones = self._zones.sort_values(['PD', 'Zone']).reset_index()
         self._zones['zone_idx'] = self._zones['Zone']
         self._zones.set_index('zone_idx', inplace=True)
+
+        # zone centroids, used for spatial imputation where available
+        zone_file = pd.read_csv(self._config['Zones'], usecols=lambda c: c in ['Zone', 'X', 'Y'])
+        if {'X', 'Y'}.issubset(zone_file.columns):
+            self._zone_coordinates = zone_file.set_index('Zone')[['X', 'Y']]
         return
         # zone_list = self._zones['Zone'].to_list()
         # missing_zones = self._find_missing(zone_list)
@@ -2,10 +2,65 @@ import pandas as pd
 import numpy as np
 import gtamodel_popsyn.constants as constants
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn._input_cache import InputCache
 import gtamodel_popsyn.control_totals_builder as ctb
 from shutil import copyfile
 
 from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
+from gtamodel_popsyn.util.compact_households import compact_households
+from gtamodel_popsyn.util.intermediate_store import write_intermediate
+from gtamodel_popsyn.util.map_partitions import map_partitions
+from gtamodel_popsyn.util.read_seed_file import read_seed_file, PERSONS_SEED_SCHEMA, HOUSEHOLDS_SEED_SCHEMA
+from gtamodel_popsyn.util.resample_invalid_categories import resample_invalid_categories
+from gtamodel_popsyn.util.stratified_sample import stratified_sample
+
+"""
+Invalid (unknown) category values of the seed records, resampled from the valid values of the puma.
+"""
+INVALID_HOUSEHOLD_CATEGORIES = {'IncomeClass': 7}
+INVALID_PERSON_CATEGORIES = {'Occupation': '9', 'EmploymentStatus': '9', 'StudentStatus': '9'}
+
+
+def _process_puma_partition(partition: dict) -> dict:
+    """
+    Processes the records of a single puma: invalid categories are resampled, records outside of the
+    internal zones are removed, the zonal control totals are computed and the input sample is drawn.
+    The function only depends on its partition so that it can run in a worker process.
+    :param partition:
+    :return:
+    """
+    generator = np.random.default_rng(partition['seed'])
+    households = resample_invalid_categories(partition['households'], INVALID_HOUSEHOLD_CATEGORIES,
+                                             weight_column='weighth', group_column='puma', generator=generator)
+
+    persons_households = partition['persons_households']
+    persons_households['IncomeClass'] = persons_households['HouseholdId'].map(
+        households.set_index('HouseholdId')['IncomeClass'])
+    persons_households = resample_invalid_categories(persons_households, INVALID_PERSON_CATEGORIES,
+                                                     weight_column='weightp', group_column='puma',
+                                                     generator=generator)
+
+    zone_index = partition['zone_index']
+    households = households[zone_index.is_internal(households['HouseholdZone'])]
+    persons_households = persons_households[zone_index.is_internal(persons_households['HouseholdZone'])]
+
+    totals = None
+    if partition['control_plan'] is not None:
+        totals = partition['control_plan'].zone_totals(households, persons_households, zone_index)
+
+    selected, expansion = stratified_sample(persons_households['HouseholdId'],
+                                            persons_households[partition['input_sample_stratum']],
+                                            partition['input_sample'], generator)
+    sampled_persons_households = persons_households[selected]
+    if partition['input_sample_rescale']:
+        sampled_persons_households = sampled_persons_households.assign(
+            weightp=sampled_persons_households['weightp'] * expansion[selected],
+            weighth=sampled_persons_households['weighth'] * expansion[selected])
+
+    return {'households': households,
+            'persons_households': persons_households,
+            'sampled_persons_households': sampled_persons_households,
+            'totals': totals}
 
 
 class InputProcessor(GTAModelPopSynProcessor):
@@ -36,6 +91,10 @@ class InputProcessor(GTAModelPopSynProcessor):
         self._control_totals_builder = control_totals_builder
         self._processed_persons = None
         self._processed_households = None
+        self._sampled_persons_households = None
+        self._control_totals = None
+        self._gen_pumas = False
+        self._input_cache = InputCache(gtamodel_popsyn_instance)
 
         pd.set_option('mode.chained_assignment', 'raise')
 
@@ -44,23 +103,41 @@ class InputProcessor(GTAModelPopSynProcessor):
     def generate(self, build_controls: bool = True, gen_pumas: bool = False):
         """
         Process the model input data and generate control files and
-        seed records in the appropriate formats.
+        seed records in the appropriate formats. When the input cache is enabled, the results of a
+        previous run with identical inputs and configuration are restored instead.
+        :param build_controls: Whether the zonal control totals are computed.
+        :param gen_pumas: Generate balanced pumas (GeneratePumas) instead of using PdGroups.
         :return:
         """
 
+        self._gen_pumas = gen_pumas
+        cache_key = None
+        if build_controls and self._input_cache.enabled:
+            cache_key = self._input_cache.key(gen_pumas)
+            if self._input_cache.restore(cache_key, gen_pumas):
+                if gen_pumas and 'GeneratePumas' in self._config:
+                    zone_pumas = pd.read_csv(f'{self._output_path}/Inputs/zone_pumas.csv')
+                    self.popsyn_config.restore_pumas(zone_pumas.set_index('Zone')['puma'])
+                return
+
         self._process_zones_file()
         # read input data
         self._read_persons_households()
-        # perform control total processing here
+        # resample, filter, total and sample the records of each puma
+        self._process_partitions(build_controls)
 
         if build_controls:
             self._control_totals_builder.build_control_totals(self._households_base,
                                                               self._persons_households,
-                                                              self._zones)
+                                                              self._zones,
+                                                              totals=self._control_totals)
 
         # perform any post process modifications and write results to file
         self._post_process_persons_households()
 
+        if cache_key is not None:
+            self._input_cache.store(cache_key, gen_pumas)
+
         return
 
     def _find_missing(self, id_list: list):
@@ -69,8 +146,7 @@ class InputProcessor(GTAModelPopSynProcessor):
         @param id_list:
         @return: list
         """
-        return [x for x in range(id_list[0], id_list[-1] + 1)
-                if x not in id_list]
+        return np.setdiff1d(np.arange(id_list[0], id_list[-1] + 1), id_list).tolist()
 
     def _process_zones_file(self):
         """
@@ -94,11 +170,11 @@ class InputProcessor(GTAModelPopSynProcessor):
         :return:
         """
         # read in csv data
-        self._persons_base = pd.read_csv(f"{self._config['PersonsSeedFile']}",
-                                         dtype={'HouseholdId': int})
+        self._persons_base = read_seed_file(f"{self._config['PersonsSeedFile']}", PERSONS_SEED_SCHEMA,
+                                            chunk_size=self._config.get('SeedChunkSize'))
 
-        self._households_base = pd.read_csv(f"{self._config['HouseholdsSeedFile']}",
-                                            dtype={'HouseholdZone': int, 'HouseholdId': int})
+        self._households_base = read_seed_file(f"{self._config['HouseholdsSeedFile']}", HOUSEHOLDS_SEED_SCHEMA,
+                                               chunk_size=self._config.get('SeedChunkSize'))
 
         # down sample input population
         # self._households_base = self._households_base.sample(frac=self._config['InputSample'])
@@ -107,10 +183,13 @@ class InputProcessor(GTAModelPopSynProcessor):
                                          left_on="HouseholdZone", right_on="Zone")[
             ['HouseholdId', 'DwellingType', 'NumberOfPersons', 'Vehicles',
              'IncomeClass', 'ExpansionFactor', 'HouseholdZone', 'PD']] \
-            .sort_values(by=['HouseholdZone'], ascending=True).reset_index()
+            .sort_values(by=['HouseholdZone'], ascending=True, kind='stable').reset_index(drop=True)
 
         # assign appropriate puma values
-        self._assign_puma_values()
+        if self._gen_pumas:
+            self.assign_puma_using_generated_values()
+        else:
+            self._assign_puma_values()
         self._preprocess_households()
         self._preprocess_persons()
 
@@ -120,63 +199,84 @@ class InputProcessor(GTAModelPopSynProcessor):
                                             right_on="HouseholdId",
                                             how="inner")
 
-        self._preprocess_persons_households()
-        self._filter_records()
-
         return
 
-    def _filter_records(self):
+    def _process_partitions(self, build_controls: bool):
         """
-        Filters household and persons records from invalid zones and PDs
+        Partitions the households and joined persons households records by puma and processes the
+        partitions, in a pool of Workers processes when configured. Each partition draws from its own
+        random stream, seeded from RandomSeed and its puma, so results do not depend on the number
+        of workers.
+        :param build_controls: Whether the zonal control totals are computed.
         :return:
         """
-        self._households_base = \
-            self._households_base[self._households_base.HouseholdZone.isin(self.popsyn_config.internal_zone_range)]
-        self._persons_households = self._persons_households[
-            self._persons_households['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
-
-        self._households_base = self._households_base[
-            self._households_base['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
-        self._persons_households.sort_values(by=['HouseholdZone', 'PD'],
-                                             ascending=True).reset_index(inplace=True)
+        seed = self._config['RandomSeed'] if 'RandomSeed' in self._config else np.random.randint(0, 2 ** 31 - 1)
+        persons_households = dict(list(self._persons_households.groupby('puma')))
+        partitions = [{'seed': [int(seed), int(puma)],
+                       'households': households.copy(),
+                       'persons_households': persons_households[puma].copy() if puma in persons_households
+                       else self._persons_households.iloc[0:0].copy(),
+                       'zone_index': self.popsyn_config.zone_index,
+                       'control_plan': self._control_totals_builder.control_plan if build_controls else None,
+                       'input_sample': self._config['InputSample'],
+                       'input_sample_stratum': self._config.get('InputSampleStratum', 'puma'),
+                       'input_sample_rescale': self._config.get('InputSampleRescale', False)}
+                      for puma, households in self._households_base.groupby('puma')]
+
+        results = map_partitions(_process_puma_partition, partitions, int(self._config.get('Workers', 1)))
+
+        self._households_base = pd.concat([r['households'] for r in results])
+        self._persons_households = pd.concat([r['persons_households'] for r in results])
+        self._sampled_persons_households = pd.concat([r['sampled_persons_households'] for r in results]) \
+            .reset_index(drop=True)
+        self._control_totals = pd.concat([r['totals'] for r in results]) if build_controls else None
         return
 
     def assign_puma_using_generated_values(self):
         """
         Assigns associated puma values splitting the population as evenly as possible
-        across the number of puma requested.
+        across the number of puma requested (GeneratePumas).
 
-        This method assumes that some controls are already predefined, and will not be generated from
-        input seed data.
+        The zones are weighted by their expanded seed population, or by their number of seed households
+        when GeneratePumasWeight is households, and whole PDs are kept in a puma unless GeneratePumasByPd
+        is false. The generated pumas replace the PdGroups pumas for every later stage, and the balance
+        of the partition is written to Inputs/puma_balance.csv, and the puma of every zone to
+        Inputs/zone_pumas.csv.
         @return:
         """
 
-        if 'GeneratePumas ' in self._config:
-            maz = pd.read_csv(f"{self._output_path}/Inputs/{self._config['MazLevelControls']}")
-
-            # get the list of total population in controls
-            for index,row in maz.iterrows():
-                self._zones.loc[row['maz'],'puma'] = 1
-
-        else:
+        if 'GeneratePumas' not in self._config:
             # call standard puma, configuration is missing information
+            self._logger.warning('GeneratePumas is not configured, using the PdGroups puma values.')
             return self._assign_puma_values()
 
+        weight = self._config.get('GeneratePumasWeight', 'population')
+        if weight == 'population':
+            zone_weights = (self._households_base['ExpansionFactor'] * self._households_base['NumberOfPersons']) \
+                .groupby(self._households_base['HouseholdZone']).sum()
+        elif weight == 'households':
+            zone_weights = self._households_base.groupby('HouseholdZone').size()
+        else:
+            raise ValueError(f'GeneratePumasWeight must be population or households, got {weight}.')
+
+        balance = self.popsyn_config.generate_pumas(zone_weights, int(self._config['GeneratePumas']),
+                                                    respect_pds=self._config.get('GeneratePumasByPd', True))
+        balance.to_csv(f'{self._output_path}/Inputs/puma_balance.csv')
+        zones = self._zones['Zone'].drop_duplicates().sort_values().to_numpy()
+        pd.DataFrame({'Zone': zones, 'puma': self.popsyn_config.zone_index.zone_pumas(zones)}).to_csv(
+            f'{self._output_path}/Inputs/zone_pumas.csv', index=False)
+        self._logger.info(f'Generated {len(balance)} pumas by {weight}, largest puma is '
+                          f'{balance["Ratio"].max():.3f} times the mean and smallest {balance["Ratio"].min():.3f}.')
+        return self._assign_puma_values()
+
     def _assign_puma_values(self):
         """
         Assigns the associated puma assignment from PD values from predefined setting
         :return:
         """
-        self._households_base['puma'] = 0
-        self._zones['puma'] = 0
-        pd_ranges = []
-        for r in self._config['PdGroups']:
-            pd_ranges.append(range(r[0], r[1]))
-
-        for index, pd_range in enumerate(pd_ranges):
-            self._zones.loc[self._zones['PD'].between(pd_range.start, pd_range.stop, inclusive=True), ['puma']] = index + 1
-            self._households_base.loc[
-                self._households_base['PD'].between(pd_range.start, pd_range.stop, inclusive=True), ['puma']] = index + 1
+        zone_index = self.popsyn_config.zone_index
+        self._zones['puma'] = zone_index.zone_pumas(self._zones['Zone'])
+        self._households_base['puma'] = zone_index.zone_pumas(self._households_base['HouseholdZone'])
 
         self._logger.info('Unique puma indices: ' + str(self._households_base['puma'].unique()))
 
@@ -185,58 +285,6 @@ class InputProcessor(GTAModelPopSynProcessor):
         Process any person specific attributes before the control generation stage.
         """
         self._persons_base.rename(columns={'ExpansionFactor': 'weightp'}, inplace=True)
-        self._persons_base.EmploymentZone = self._persons_base.EmploymentZone.astype(int)
-
-    def _preprocess_persons_households(self):
-        """
-        Preprocesses the join persons and households information. This step usually involves
-        removing invalid record attributes and replacing it with a draw from a distribution
-        of  its associated geography.
-        :return:
-        """
-        self._persons_households = self._resample_invalid_category(self._persons_households, 'Occupation', '9', weight_column='weightp')
-        self._persons_households = self._resample_invalid_category(self._persons_households, 'EmploymentStatus', '9', weight_column='weightp')
-        self._persons_households = self._resample_invalid_category(self._persons_households, 'StudentStatus', '9', weight_column='weightp')
-
-    def _resample_invalid_category(self, df, category, invalid_value, weight_column: str, aggregate_column='puma'):
-        """
-        Resamples attributes for all records with an invalid value for the associated
-        category.
-        :param category:
-        :param invalid_value:
-        :return:
-        """
-        import numpy as nmp
-        ##distributions = df.loc[
-         #   df[category] != invalid_value].groupby(aggregate_column)[
-        #    category].value_counts(
-        #    normalize=True)
-
-        #def apply_resample(row):
-        #    """
-        #    Adjust the category for this row
-        #    :param row:
-        #    :return:
-         #   """
-         #   if row[category] == invalid_value:
-         #       row[category] = nmp.random.choice(
-         #           distributions[row[aggregate_column]].index.to_list(),
-          #          p=distributions[row[aggregate_column]].to_list())
-          #  return row
-
-        #distributions = df.loc[df[category] != invalid_value].groupby(aggregate_column).
-
-        df_valid = df.loc[df[category] != invalid_value]
-        df_invalid = df[category] == invalid_value
-        valid_options = df.loc[df[category] != invalid_value,category].unique()
-        distributions = df_valid.groupby([aggregate_column, category])[weight_column].sum().apply(lambda x: x) / df_valid.groupby([aggregate_column])[weight_column].sum()
-
-        resampled_values = nmp.random.choice(valid_options, p=distributions[1], size=df_invalid.sum())
-
-        df.loc[df_invalid,category] = resampled_values
-        return df
-
-        #return df.apply(lambda x: apply_resample(x), axis=1)
 
     def _preprocess_households(self):
         """
@@ -244,17 +292,11 @@ class InputProcessor(GTAModelPopSynProcessor):
         """
         self._households_base.PD = self._households_base.PD.astype(int)
         self._households_base.puma = self._households_base.puma.astype(int)
-        self._households_base.HouseholdZone = self._households_base.HouseholdZone.astype(int)
-
-        self._households_base.IncomeClass = self._households_base.IncomeClass.astype(int)
         self._households_base.rename(columns={'ExpansionFactor': 'weighth'}, inplace=True)
 
         # self._households_base.update(self._households_base.loc[self._households_base.IncomeClass == 7,'IncomeClass'].apply(
         #    lambda x: np.random.randint(1, 7)))
 
-        self._households_base = self._resample_invalid_category(
-            self._households_base, 'IncomeClass', 7, weight_column='weighth')
-
         # self._households_base.loc[self._households_base.IncomeClass == 7, 'IncomeClass']\
         #    = self._households_base.loc[self._households_base.IncomeClass == 7,'IncomeClass'].apply(
         #    lambda x: np.random.randint(1, 7))
@@ -290,17 +332,46 @@ class InputProcessor(GTAModelPopSynProcessor):
         #sample_hids = pd.Series(self._persons_households('HouseholdId').unique()).sample(
         #    frac=self._config['InputSample'])
 
-        self._persons_households = \
-            self._persons_households.groupby('puma').apply(lambda x: x[x.HouseholdId.isin(x.HouseholdId.sample(frac=self._config['InputSample']))]).reset_index(drop=True)
+        self._persons_households = self._sampled_persons_households
 
         #self._persons_households = self._persons_households[self._persons_households['HouseholdId'].isin(sample_hids)]
 
         self._postprocess_persons()
         self._postprocess_households()
+        if self._config.get('CompactSeeds', False):
+            self._compact_seeds()
+        self._write_processed_seeds()
+
+    def _compact_seeds(self):
+        """
+        Collapses the processed seed households with identical attributes and person records within a puma
+        into a single household, summing their weights, and writes the mapping of the original household
+        ids to the kept ones to Inputs/seed_household_map.csv.
+        :return:
+        """
+        household_count = len(self._processed_households)
+        self._processed_households, self._processed_persons, household_map = compact_households(
+            self._processed_households, self._processed_persons, household_weights=['weight'],
+            person_weights=['weight', 'weightp'])
+        self._processed_households['weight'] = self._processed_households['weight'].round(5)
+        self._processed_persons['weight'] = self._processed_persons['weight'].round(5)
+        self._processed_persons['weightp'] = self._processed_persons['weightp'].round(5)
+        household_map.to_csv(f'{self._output_path}/Inputs/seed_household_map.csv')
+        self._logger.info(f'Compacted {household_count} seed households into {len(self._processed_households)}.')
+
+    def _write_processed_seeds(self):
+        """
+        Writes the processed seed households and persons.
+        :return:
+        """
+        write_intermediate(self._processed_households, f"{self._config['ProcessedHouseholdsSeedFile']}",
+                           self._config.get('IntermediateFormat', 'csv'))
+        write_intermediate(self._processed_persons, f"{self._config['ProcessedPersonsSeedFile']}",
+                           self._config.get('IntermediateFormat', 'csv'))
 
     def _postprocess_households(self):
         """
-        Performs any post process modifications to household records and writes the results to file.
+        Performs any post process modifications to household records.
         :return:
         """
         households = self._persons_households[['HouseholdId', 'puma', 'DwellingType',
@@ -313,7 +384,6 @@ class InputProcessor(GTAModelPopSynProcessor):
         households['puma'] = households['puma'].astype(int)
         self._processed_households = households
         self._processed_households['weight'] = self._processed_households['weight'].round(5)
-        households.to_csv(f"{self._config['ProcessedHouseholdsSeedFile']}", index=False)
 
     def _postprocess_persons(self):
         """
@@ -327,12 +397,10 @@ class InputProcessor(GTAModelPopSynProcessor):
         persons.rename(columns={'weightp': 'weight'}, inplace=True)
 
         for mapping in self._config['CategoryMapping']['Persons'].items():
-            persons.loc[:, mapping[0]] = persons.loc[:, mapping[0]].map(mapping[1])
+            persons[mapping[0]] = persons[mapping[0]].astype(object).map(mapping[1])
 
         persons.sort_values(by=['HouseholdId'], ascending=True).reset_index(inplace=True)
         persons['HouseholdId'] = persons['HouseholdId'].astype(int)
         persons['puma'] = persons['puma'].astype(int)
         self._processed_persons = persons
         self._processed_persons['weightp'] = self._processed_persons['weight'].round(5)
-        self._processed_persons.to_csv(f"{self._config['ProcessedPersonsSeedFile']}",
-                                       index=False)
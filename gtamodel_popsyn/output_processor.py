@@ -1,9 +1,9 @@
 import pandas as pd
 from logzero import setup_logger
-from sqlalchemy import create_engine
 import gtamodel_popsyn.sql_commands as sql_commands
 from gtamodel_popsyn.constants import *
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.aggregation_cube import population_cubes, file_signatures
 import os
 
 from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
@@ -27,12 +27,10 @@ class OutputProcessor(GTAModelPopSynProcessor):
         self._persons = pd.DataFrame()
         self._households = pd.DataFrame()
         self._persons_households = pd.DataFrame()
+        self._population_cubes = {}
         self._output_folder = self._output_path
         self._percent_population = percent_population
-        self._engine = create_engine(
-            f'mysql+pymysql://{self._config["DatabaseUser"]}:'
-            f'{self._config["DatabasePassword"]}@{self._config["DatabaseServer"]}/{self._config["DatabaseName"]}'
-        )
+        self._database = gtamodel_popsyn_instance.database
 
         try:
             os.makedirs(f'{self._output_folder}/ZonalResidence/')
@@ -149,34 +147,38 @@ class OutputProcessor(GTAModelPopSynProcessor):
 
         self._logger.info("Processing zonal residence information for occupation and employment.")
 
-        internal_persons_households = self._persons_households.loc[
-            self._persons_households.EmploymentZone.isin(self.popsyn_config.internal_zone_range)].copy()
-        internal_persons_households.rename(columns={'HouseholdZone': 'Zone'}, inplace=True)
-
-        gta_ph_grouped = internal_persons_households.groupby(['Zone', 'Occupation', 'EmploymentStatus'])
-
-        gta_ph_grouped = gta_ph_grouped['Persons'].apply(sum)
-
-        # print(gta_ph_grouped)
-
-        # gta_ph_grouped.reset_index().to_csv('temp/all.csv',index=False)
-
-        gta_ph_grouped[:, 'G', 'F'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/GF.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'G', 'P'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/GP.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'M', 'F'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/MF.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'M', 'P'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/MP.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'P', 'F'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/PF.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'P', 'P'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/PP.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'S', 'F'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/SF.csv',
-                                                         index=False)
-        gta_ph_grouped[:, 'S', 'P'].reset_index().to_csv(f'{self._output_folder}/ZonalResidence/SP.csv',
-                                                         index=False)
+        residences = self._population_cubes['persons'].select(EmploymentZoneType='internal') \
+            .series(['Occupation', 'EmploymentStatus'], zone_name='Zone')
+
+        for occupation, employment_status in [('G', 'F'), ('G', 'P'), ('M', 'F'), ('M', 'P'),
+                                              ('P', 'F'), ('P', 'P'), ('S', 'F'), ('S', 'P')]:
+            residences[:, occupation, employment_status].reset_index().to_csv(
+                f'{self._output_folder}/ZonalResidence/{occupation}{employment_status}.csv', index=False)
+        return
+
+    def _process_population_cubes(self):
+        """
+        Aggregates the synthesized persons and households into zone x attribute cubes, used by the
+        zonal residence and validation summaries.
+        :return:
+        """
+        self._logger.info("Aggregating synthesized population.")
+        self._population_cubes = population_cubes(self._persons_households, self._households,
+                                                  person_weight='Persons', household_weight='ExpansionFactor',
+                                                  zone_index=self.popsyn_config.zone_index)
+        return
+
+    def _write_population_cubes(self):
+        """
+        Writes the population cubes to the Aggregations folder, with the signatures of the output files they
+        were aggregated from so that they are only reused for the same outputs.
+        :return:
+        """
+        os.makedirs(f'{self._output_folder}/Aggregations/', exist_ok=True)
+        sources = file_signatures([f'{self._output_folder}/HouseholdData/Households.csv',
+                                   f'{self._output_folder}/HouseholdData/Persons.csv'])
+        for name, cube in self._population_cubes.items():
+            cube.save(f'{self._output_folder}/Aggregations/{name}.npz', sources)
         return
 
     def _read_persons_households_file(self):
@@ -223,15 +225,19 @@ class OutputProcessor(GTAModelPopSynProcessor):
         Generates and writes all output files to the specified output location
         :return:
         """
-        self._db_connection = self._engine.connect()
-        if self._arguments.use_database_controls:
-            self._extract_control_tables()
+        if self._arguments.use_database_controls or not use_saved:
+            with self._database.session() as connection:
+                self._db_connection = connection
+                if self._arguments.use_database_controls:
+                    self._extract_control_tables()
+
+                if not use_saved:
+                    # Create and transform required db tables
+                    self._gta_model_transform()
+                    self._read_persons_households()
 
         # Read and process household and persons data
         if not use_saved:
-            # Create and transform required db tables
-            self._gta_model_transform()
-            self._read_persons_households()
             self._process_persons()
             self._process_households()
         else:
@@ -241,13 +247,14 @@ class OutputProcessor(GTAModelPopSynProcessor):
             self.merge_outputs(merge_outputs)
 
         self._process_persons_households()
+        self._process_population_cubes()
 
         self._process_zonal_residences()
 
         # Process and write outputs
         self._write_households_file()
         self._write_persons_file()
-        self._db_connection.close()
+        self._write_population_cubes()
         self._logger.info("Finished output processing.")
         return
 
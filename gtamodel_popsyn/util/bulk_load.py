@@ -0,0 +1,115 @@
+import os
+import queue
+import tempfile
+import threading
+
+import pandas as pd
+from sqlalchemy.exc import DBAPIError
+
+
+def _write_file(frame: pd.DataFrame) -> str:
+    """
+    Writes the records to a temporary tab separated file, missing values as \\N.
+    """
+    handle, path = tempfile.mkstemp(suffix='.tsv')
+    os.close(handle)
+    frame.to_csv(path, sep='\t', header=False, index=False, na_rep='\\N')
+    return path
+
+
+def _load_file(path: str, table_name: str, columns: list, connection):
+    """
+    Loads a tab separated file into the table with LOAD DATA LOCAL INFILE.
+    """
+    line_terminator = '\\r\\n' if os.linesep == '\r\n' else '\\n'
+    connection.execute(
+        f"LOAD DATA LOCAL INFILE '{path.replace(os.sep, '/')}' INTO TABLE `{table_name}` "
+        f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '{line_terminator}' "
+        f"({', '.join(f'`{column}`' for column in columns)})")
+
+
+def _encode_chunks(frame: pd.DataFrame, chunk_rows: int, paths: queue.Queue, stop: threading.Event):
+    """
+    Writes the records in chunks of rows to temporary files, queuing their paths followed by None (or the
+    error that stopped the encoding).
+    """
+    try:
+        for start in range(0, len(frame), chunk_rows):
+            if stop.is_set():
+                break
+            paths.put(_write_file(frame.iloc[start:start + chunk_rows]))
+        paths.put(None)
+    except Exception as error:
+        paths.put(error)
+
+
+def _load_data_infile(frame: pd.DataFrame, table_name: str, connection, chunk_rows: int = 0):
+    """
+    Loads the frame with LOAD DATA LOCAL INFILE. Frames of more than chunk_rows rows are encoded to files
+    chunk by chunk in a separate thread, at most two chunks ahead of the chunk being loaded, so that the
+    encoding overlaps with the upload while only a few chunks are held at once.
+    """
+    columns = list(frame.columns)
+    if not chunk_rows or len(frame) <= chunk_rows:
+        path = _write_file(frame)
+        try:
+            _load_file(path, table_name, columns, connection)
+        finally:
+            os.remove(path)
+        return
+
+    paths = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    encoder = threading.Thread(target=_encode_chunks, args=(frame, chunk_rows, paths, stop), daemon=True)
+    encoder.start()
+    finished = False
+    try:
+        while not finished:
+            item = paths.get()
+            finished = not isinstance(item, str)
+            if isinstance(item, Exception):
+                raise item
+            if not finished:
+                try:
+                    _load_file(item, table_name, columns, connection)
+                finally:
+                    os.remove(item)
+    finally:
+        # stop the encoder and remove the files it queued if the load failed
+        stop.set()
+        while not finished:
+            item = paths.get()
+            finished = not isinstance(item, str)
+            if not finished:
+                os.remove(item)
+        encoder.join()
+
+
+def bulk_load(frame: pd.DataFrame, table_name: str, connection, local_infile: bool = True,
+              chunk_size: int = 5000, load_chunk_size: int = 0) -> bool:
+    """
+    Appends the records of a frame to an existing table within a single transaction, or a savepoint of
+    the transaction already open on the connection. The records are loaded with LOAD DATA LOCAL INFILE from a temporary file when possible, which requires local_infile
+    to be enabled on both the client connection and the server. Otherwise, or when the bulk load is
+    rejected, the records are inserted with multi row INSERT statements of chunk_size rows.
+    @param frame: The records, with columns named as the table columns.
+    @param table_name:
+    @param connection: An open database connection.
+    @param local_infile: Whether LOAD DATA LOCAL INFILE is attempted.
+    @param chunk_size: Number of rows per INSERT statement of the fallback.
+    @param load_chunk_size: Number of rows per LOAD DATA statement, encoded concurrently with the loading of
+    the previous chunk (0 for a single statement).
+    @return: True if the records were bulk loaded, False if they were inserted.
+    """
+    if local_infile:
+        transaction = connection.begin_nested() if connection.in_transaction() else connection.begin()
+        try:
+            _load_data_infile(frame, table_name, connection, load_chunk_size)
+            transaction.commit()
+            return True
+        except DBAPIError:
+            transaction.rollback()
+
+    with connection.begin():
+        frame.to_sql(table_name, connection, if_exists='append', index=False, method='multi', chunksize=chunk_size)
+    return False
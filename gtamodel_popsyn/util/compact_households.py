@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+def _column_codes(frame: pd.DataFrame, columns: list) -> np.ndarray:
+    """
+    Encodes each column as integer codes, missing values as -1.
+    """
+    return np.stack([pd.factorize(frame[column])[0] for column in columns], axis=1).astype(np.int64) \
+        if columns else np.zeros((len(frame), 0), dtype=np.int64)
+
+
+def compact_households(households: pd.DataFrame, persons: pd.DataFrame, household_weights: list,
+                       person_weights: list) -> tuple:
+    """
+    Collapses seed households with an identical signature into a single household. The signature is
+    every household column, and the records of its persons in PersonNumber order, other than the
+    HouseholdId, PersonNumber and weight columns, so that households are only merged within the same
+    puma. The first household of each signature is kept, with the weights of its duplicates added to
+    its own weights and to those of its persons (by position in the household).
+
+    The signatures are encoded as rows of integer codes and grouped exactly with a single unique over
+    the rows. Every person must belong to one of the households.
+    @param households: The household records (HouseholdId).
+    @param persons: The person records (HouseholdId, PersonNumber).
+    @param household_weights: Weight columns of the households.
+    @param person_weights: Weight columns of the persons.
+    @return: The compacted households and persons, and a series mapping each original HouseholdId to
+    the HouseholdId of the household it was merged into.
+    """
+    household_ids = households['HouseholdId'].to_numpy()
+    persons = persons.sort_values(['HouseholdId', 'PersonNumber'], kind='stable')
+    person_households = pd.Index(household_ids).get_indexer(persons['HouseholdId'])
+    positions = persons.groupby('HouseholdId', sort=False).cumcount().to_numpy()
+    position_count = positions.max(initial=-1) + 1
+
+    # household columns followed by the columns of each person position, -2 for absent persons
+    person_columns = [column for column in persons.columns
+                      if column not in ['HouseholdId', 'PersonNumber'] + person_weights]
+    person_codes = _column_codes(persons, person_columns)
+    wide = np.full((len(households), position_count, len(person_columns)), -2, dtype=np.int64)
+    wide[person_households, positions] = person_codes
+    signatures = np.concatenate(
+        [_column_codes(households, [column for column in households.columns
+                                    if column not in ['HouseholdId'] + household_weights]),
+         wide.reshape(len(households), -1)], axis=1)
+
+    _, groups = np.unique(signatures, axis=0, return_inverse=True)
+    groups = groups.reshape(-1)
+    group_count = groups.max(initial=-1) + 1
+
+    # the first household of each group represents it
+    representatives = np.full(group_count, len(households), dtype=np.int64)
+    np.minimum.at(representatives, groups, np.arange(len(households)))
+    kept = np.zeros(len(households), dtype=bool)
+    kept[representatives] = True
+
+    compacted_households = households[kept].copy()
+    for column in household_weights:
+        totals = np.bincount(groups, weights=households[column].to_numpy(dtype=np.float64), minlength=group_count)
+        compacted_households[column] = totals[groups[kept]]
+
+    person_cells = groups[person_households] * position_count + positions
+    kept_persons = kept[person_households]
+    compacted_persons = persons[kept_persons].copy()
+    for column in person_weights:
+        totals = np.bincount(person_cells, weights=persons[column].to_numpy(dtype=np.float64),
+                             minlength=group_count * position_count)
+        compacted_persons[column] = totals[person_cells[kept_persons]]
+
+    household_map = pd.Series(household_ids[representatives[groups]], index=pd.Index(household_ids, name='HouseholdId'),
+                              name='SeedHouseholdId')
+    return compacted_households, compacted_persons, household_map
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+
+def control_changes(controls: pd.DataFrame, stored: pd.DataFrame, keys: list) -> tuple:
+    """
+    Compares control totals to the stored controls of the same table, matching rows by their key columns.
+    Rows are changed when their key is new or any of their values differs (missing values compare equal).
+    @param controls: The new control totals, with unique keys.
+    @param stored: The stored control totals, with the same columns.
+    @param keys: The key columns, e.g. region, puma, taz, maz.
+    @return: Tuple of the changed rows of the controls, and the keys of the stored rows no longer present.
+    """
+    value_columns = [c for c in controls.columns if c not in keys]
+    merged = controls[keys].merge(stored, on=keys, how='left', indicator=True)
+    changed = merged['_merge'].to_numpy() == 'left_only'
+    for column in value_columns:
+        values = controls[column].to_numpy()
+        stored_values = merged[column].to_numpy()
+        changed |= ~((values == stored_values) | (pd.isna(values) & pd.isna(stored_values)))
+
+    removed = stored[keys].merge(controls[keys], on=keys, how='left', indicator=True)
+    return controls[changed], removed.loc[np.asarray(removed['_merge'] == 'left_only'), keys]
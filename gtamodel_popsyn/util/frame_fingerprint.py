@@ -0,0 +1,18 @@
+import hashlib
+
+import pandas as pd
+
+
+def frame_fingerprint(*frames: pd.DataFrame, options: list = None) -> str:
+    """
+    Computes a fingerprint of the schema (column names and types) and content (rows, in order) of one or
+    more frames, from the pandas row hashes.
+    @param frames:
+    @param options: Additional values (e.g. loading options) the fingerprint depends on.
+    @return: The hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(repr(options or []).encode())
+    for frame in frames:
+        digest.update(repr([(str(c), frame.dtypes[c].name) for c in frame.columns]).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
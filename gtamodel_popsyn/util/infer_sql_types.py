@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import mysql
+
+INTEGER_TYPES = [(mysql.TINYINT, 8), (mysql.SMALLINT, 16), (mysql.MEDIUMINT, 24), (mysql.INTEGER, 32),
+                 (mysql.BIGINT, 64)]
+
+
+def _integer_type(minimum: int, maximum: int):
+    """
+    Returns the narrowest MySQL integer type holding the range, unsigned when it is not negative.
+    """
+    for sql_type, bits in INTEGER_TYPES:
+        if minimum >= 0 and maximum < 2 ** bits:
+            return sql_type(unsigned=True)
+        if -2 ** (bits - 1) <= minimum and maximum < 2 ** (bits - 1):
+            return sql_type()
+    return mysql.BIGINT()
+
+
+def infer_sql_type(values: pd.Series, enum_limit: int = 32):
+    """
+    Infers the narrowest MySQL column type storing the observed values exactly. Integers (including object
+    columns holding only integers, e.g. mapped categories) get the smallest integer type of their range,
+    single and double precision floats FLOAT and DOUBLE, letter codes of up to three characters with at
+    most enum_limit distinct values an ENUM, and other values CHAR or VARCHAR of their longest text.
+    @param values:
+    @param enum_limit: The largest number of distinct codes stored as an ENUM.
+    @return: The SQLAlchemy MySQL type.
+    """
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return _integer_type(int(values.min()), int(values.max())) if len(values) else mysql.INTEGER()
+    if kind == 'f':
+        return mysql.FLOAT() if values.dtype.itemsize == 4 else mysql.DOUBLE()
+
+    present = values.dropna()
+    value_types = set(present.map(type))
+    if value_types and all(issubclass(t, (int, np.integer)) and not issubclass(t, (bool, np.bool_))
+                           for t in value_types):
+        return _integer_type(int(present.min()), int(present.max()))
+    if value_types and all(issubclass(t, (int, float, np.integer, np.floating)) for t in value_types):
+        return mysql.DOUBLE()
+
+    text = present.astype(str)
+    lengths = text.str.len()
+    width = max(int(lengths.max()) if len(text) else 1, 1)
+    codes = text.unique()
+    if 0 < len(codes) <= enum_limit and width <= 3 and all(code.isalpha() for code in codes):
+        return mysql.ENUM(*sorted(codes))
+    return mysql.CHAR(width) if int(lengths.min() if len(text) else 0) == width else mysql.VARCHAR(width)
+
+
+def infer_sql_types(frame: pd.DataFrame, enum_limit: int = 32) -> dict:
+    """
+    Infers the MySQL column type of every column of a frame.
+    @param frame:
+    @param enum_limit: The largest number of distinct codes stored as an ENUM.
+    @return: Dictionary of the SQLAlchemy MySQL type of each column.
+    """
+    return {column: infer_sql_type(frame[column], enum_limit) for column in frame.columns}
+
+
+def sql_type_names(sql_types: dict) -> list:
+    """
+    Renders column types as MySQL DDL, e.g. for comparing or fingerprinting schemas.
+    @param sql_types: Dictionary of the SQLAlchemy type of each column.
+    @return: List of (column, type) pairs.
+    """
+    return [(column, str(sql_type.compile(dialect=mysql.dialect()))) for column, sql_type in sql_types.items()]
@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+"""
+Supported formats of the intermediate (processed seed and control) files, and their file extensions.
+"""
+INTERMEDIATE_FORMATS = {'csv': '.csv', 'feather': '.feather', 'parquet': '.parquet'}
+
+
+def intermediate_path(path: str, file_format: str) -> str:
+    """
+    Returns the location of an intermediate file in the passed format: the configured (CSV) path with
+    the extension of the format.
+    @param path: The configured path of the file.
+    @param file_format: One of INTERMEDIATE_FORMATS.
+    @return:
+    """
+    if file_format not in INTERMEDIATE_FORMATS:
+        raise ValueError(f'Unknown intermediate format {file_format}, must be one of {list(INTERMEDIATE_FORMATS)}.')
+    if file_format == 'csv':
+        return path
+    return f'{os.path.splitext(path)[0]}{INTERMEDIATE_FORMATS[file_format]}'
+
+
+def _check_pyarrow(file_format: str):
+    if file_format != 'csv' and pyarrow is None:
+        raise ImportError(f'The {file_format} intermediate format requires pyarrow to be installed.')
+
+
+def write_intermediate(frame: pd.DataFrame, path: str, file_format: str = 'csv') -> str:
+    """
+    Writes an intermediate file. The columnar formats keep the column types, including categoricals
+    and downcast integers.
+    @param frame:
+    @param path: The configured path of the file.
+    @param file_format: One of INTERMEDIATE_FORMATS.
+    @return: The path written.
+    """
+    path = intermediate_path(path, file_format)
+    _check_pyarrow(file_format)
+    if file_format == 'csv':
+        frame.to_csv(path, index=False)
+    elif file_format == 'feather':
+        pyarrow.feather.write_feather(frame.reset_index(drop=True), path)
+    else:
+        frame.to_parquet(path, index=False)
+    return path
+
+
+def read_intermediate(path: str, file_format: str = 'csv') -> pd.DataFrame:
+    """
+    Reads an intermediate file. The columnar formats are read memory mapped, with multiple threads.
+    @param path: The configured path of the file.
+    @param file_format: One of INTERMEDIATE_FORMATS.
+    @return:
+    """
+    path = intermediate_path(path, file_format)
+    _check_pyarrow(file_format)
+    if file_format == 'csv':
+        return pd.read_csv(path)
+    elif file_format == 'feather':
+        return pyarrow.feather.read_table(path, memory_map=True, use_threads=True).to_pandas()
+    return pyarrow.parquet.read_table(path, memory_map=True, use_threads=True).to_pandas()
@@ -0,0 +1,17 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_partitions(function, partitions: list, workers: int = 1) -> list:
+    """
+    Applies a function to every partition, in a pool of worker processes when more than one worker
+    is requested. The results are returned in partition order, independently of the number of workers.
+    @param function: A module level (picklable) function taking a single partition.
+    @param partitions: The list of partitions.
+    @param workers: Number of worker processes.
+    @return: List of results, one per partition.
+    """
+    if workers <= 1 or len(partitions) <= 1:
+        return [function(partition) for partition in partitions]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(partitions))) as executor:
+        return list(executor.map(function, partitions))
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+
+def _best_boundary(prefix: np.ndarray, low: int, high: int) -> int:
+    """
+    Returns the boundary b in [low + 1, high - 1] minimizing the larger of the two loads
+    prefix[b] - prefix[low] and prefix[high] - prefix[b].
+    """
+    middle = (prefix[low] + prefix[high]) / 2
+    boundary = int(np.clip(np.searchsorted(prefix, middle, side='left'), low + 1, high - 1))
+    if boundary - 1 > low and \
+            max(prefix[boundary - 1] - prefix[low], prefix[high] - prefix[boundary - 1]) <= \
+            max(prefix[boundary] - prefix[low], prefix[high] - prefix[boundary]):
+        return boundary - 1
+    return boundary
+
+
+def _capacity_boundaries(prefix: np.ndarray, capacity: float, puma_count: int) -> np.ndarray:
+    """
+    Cuts the units greedily into puma_count pumas, each extended as far as the capacity allows while
+    leaving at least one unit for every following puma.
+    """
+    unit_count = len(prefix) - 1
+    boundaries = [0]
+    for index in range(1, puma_count):
+        end = np.searchsorted(prefix, prefix[boundaries[-1]] + capacity, side='right') - 1
+        boundaries.append(int(min(max(end, boundaries[-1] + 1), unit_count - (puma_count - index))))
+    boundaries.append(unit_count)
+    return np.asarray(boundaries)
+
+
+def partition_pumas(weights, puma_count: int, max_passes: int = 100) -> np.ndarray:
+    """
+    Splits an ordered sequence of units (zones or PDs) into puma_count contiguous pumas of near equal
+    total weight, minimizing the weight of the heaviest puma.
+
+    The smallest feasible heaviest puma weight is found by bisection, each candidate being checked
+    with a greedy pass of searchsorted cuts in the cumulative weights. The boundaries are then moved,
+    pair by pair, to the position minimizing the larger of their two adjacent pumas, evening out the
+    remaining pumas without increasing the heaviest one. Every puma receives at least one unit.
+    @param weights: Weight (population or seed households) of each unit, in order.
+    @param puma_count: Number of pumas, limited to the number of units.
+    @param max_passes: Maximum number of refinement passes over the boundaries.
+    @return: The puma (1 based) of each unit.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if puma_count < 1:
+        raise ValueError(f'The number of pumas must be positive, got {puma_count}.')
+    unit_count = len(weights)
+    puma_count = min(puma_count, unit_count)
+    if puma_count <= 1:
+        return np.ones(unit_count, dtype=np.int64)
+
+    # prefix[b] is the weight of the first b units
+    prefix = np.concatenate([[0.0], np.cumsum(weights)])
+    low, high = max(prefix[-1] / puma_count, weights.max()), prefix[-1]
+    for _ in range(64):
+        capacity = (low + high) / 2
+        if np.diff(prefix[_capacity_boundaries(prefix, capacity, puma_count)]).max() <= capacity:
+            high = capacity
+        else:
+            low = capacity
+        if high - low <= 1e-9 * high:
+            break
+    boundaries = _capacity_boundaries(prefix, high, puma_count)
+
+    for _ in range(max_passes):
+        moved = False
+        for index in range(1, puma_count):
+            boundary = _best_boundary(prefix, boundaries[index - 1], boundaries[index + 1])
+            if boundary != boundaries[index]:
+                boundaries[index] = boundary
+                moved = True
+        if not moved:
+            break
+
+    return np.searchsorted(boundaries[1:-1], np.arange(unit_count), side='right') + 1
+
+
+def partition_balance(weights, pumas) -> pd.DataFrame:
+    """
+    Summarizes the balance of a puma partition.
+    @param weights: Weight of each unit.
+    @param pumas: Puma of each unit.
+    @return: Data frame indexed by puma with the number of units, the total weight and the ratio of the
+    weight to the mean puma weight.
+    """
+    balance = pd.DataFrame({'Units': 1, 'Weight': np.asarray(weights, dtype=np.float64)},
+                           index=pd.Index(np.asarray(pumas), name='puma')).groupby(level=0).sum()
+    mean = balance['Weight'].mean()
+    balance['Ratio'] = balance['Weight'] / mean if mean > 0 else 1.0
+    return balance
@@ -0,0 +1,59 @@
+import pandas as pd
+
+"""
+Column types of the persons and households seed files. Letter coded attributes are read as
+categoricals, integer attributes are downcast to the smallest integer type holding their values and
+expansion factors are kept as float64. Columns not listed are read with the default pandas types.
+"""
+PERSONS_SEED_SCHEMA = {
+    'HouseholdId': 'integer', 'PersonNumber': 'integer', 'Age': 'integer', 'Sex': 'category',
+    'License': 'category', 'TransitPass': 'category', 'EmploymentStatus': 'category', 'Occupation': 'category',
+    'FreeParking': 'category', 'StudentStatus': 'category', 'EmploymentZone': 'integer', 'SchoolZone': 'integer',
+    'ExpansionFactor': 'float'
+}
+
+HOUSEHOLDS_SEED_SCHEMA = {
+    'HouseholdId': 'integer', 'HouseholdZone': 'integer', 'DwellingType': 'integer', 'NumberOfPersons': 'integer',
+    'Vehicles': 'integer', 'IncomeClass': 'integer', 'ExpansionFactor': 'float'
+}
+
+
+def _apply_schema(frame: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """
+    Downcasts the integer columns of the schema present in the frame, and sorts the categories of the
+    categorical columns (read_csv keeps them in order of appearance) so that grouping on them follows
+    the same order as on the plain values.
+    """
+    for column, column_type in schema.items():
+        if column not in frame:
+            continue
+        if column_type == 'integer':
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+        elif column_type == 'category':
+            frame[column] = frame[column].cat.reorder_categories(sorted(frame[column].cat.categories))
+    return frame
+
+
+def read_seed_file(path: str, schema: dict, chunk_size: int = None) -> pd.DataFrame:
+    """
+    Reads a seed file with the column types of the passed schema. When a chunk size is passed the file
+    is read and typed chunk by chunk, so that no untyped copy of the whole file is held in memory.
+    @param path: Path of the seed CSV file.
+    @param schema: Mapping of column names to 'integer', 'category' or 'float'.
+    @param chunk_size: Number of rows per chunk, the whole file is read at once if None.
+    @return: The typed seed records.
+    """
+    dtypes = {column: 'category' if column_type == 'category' else 'float64'
+              for column, column_type in schema.items() if column_type != 'integer'}
+    if not chunk_size:
+        return _apply_schema(pd.read_csv(path, dtype=dtypes), schema)
+
+    chunks = [_apply_schema(chunk, schema) for chunk in pd.read_csv(path, dtype=dtypes, chunksize=chunk_size)]
+
+    # every chunk observes its own categories, unify them so the concatenation stays categorical
+    for column in chunks[0].columns:
+        if isinstance(chunks[0][column].dtype, pd.CategoricalDtype):
+            categories = sorted(set().union(*[chunk[column].cat.categories for chunk in chunks]))
+            for chunk in chunks:
+                chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
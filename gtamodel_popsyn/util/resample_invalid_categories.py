@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+
+def resample_invalid_categories(records: pd.DataFrame, categories: dict, weight_column: str, group_column: str,
+                                generator: np.random.Generator) -> pd.DataFrame:
+    """
+    Replaces the invalid values of several categories with draws from the weighted distribution of the
+    valid values of the record's group (e.g. its puma).
+
+    The draws of all groups are made at once by inverse transform sampling: the group x category
+    weights are accumulated into a single increasing array, and a uniform draw scaled into the range
+    of the record's group is located with searchsorted. Records of a group without any valid value are
+    left unchanged. The records are modified in place.
+    @param records: The household or person records.
+    @param categories: Mapping of each category column to its invalid value.
+    @param weight_column: The weight (expansion factor) column.
+    @param group_column: The column of the groups that distributions are computed for.
+    @param generator: Random generator of the draws.
+    @return: The records.
+    """
+    groups, group_values = pd.factorize(records[group_column], sort=True)
+    weights = records[weight_column].to_numpy(dtype=np.float64)
+
+    for category, invalid_value in categories.items():
+        column = records[category]
+        invalid = np.asarray(column == invalid_value, dtype=bool)
+        if not invalid.any():
+            continue
+
+        codes, values = pd.factorize(column, sort=True)
+        count = len(values)
+        valid = ~invalid & (codes >= 0) & (groups >= 0)
+        cell_weights = np.bincount(groups[valid] * count + codes[valid], weights=weights[valid],
+                                   minlength=len(group_values) * count).reshape(-1, count)
+
+        # running totals over all groups, each group covers [offsets[g], ends[g])
+        cumulative = np.cumsum(cell_weights.ravel())
+        ends = cumulative.reshape(-1, count)[:, -1]
+        offsets = np.concatenate([[0.0], ends[:-1]])
+
+        targets = np.flatnonzero(invalid & (groups >= 0))
+        targets = targets[ends[groups[targets]] > offsets[groups[targets]]]
+        if len(targets) == 0:
+            continue
+        target_groups = groups[targets]
+
+        draws = offsets[target_groups] + generator.random(len(targets)) * (ends - offsets)[target_groups]
+        cells = np.searchsorted(cumulative, draws, side='right') - target_groups * count
+
+        # keep rounding at the group boundaries within the group's weighted categories
+        positive = cell_weights > 0
+        first = np.argmax(positive, axis=1)
+        last = count - 1 - np.argmax(positive[:, ::-1], axis=1)
+        chosen = np.clip(cells, first[target_groups], last[target_groups])
+
+        records.iloc[targets, records.columns.get_loc(category)] = np.asarray(values.take(chosen))
+    return records
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+
+def stratified_sample(household_ids, strata, fraction: float, generator: np.random.Generator,
+                      minimum: int = 0) -> tuple:
+    """
+    Draws a household level stratified sample of (person or household) records. Every unique household
+    gets one random key, households are ranked by their key within their stratum, and the round(fraction
+    * households) lowest ranked households of each stratum are kept together with all of their records.
+    @param household_ids: Household id of each record, a household may span several records.
+    @param strata: Stratum (e.g. puma or zone) of each record, constant within a household.
+    @param fraction: The fraction of the households of each stratum to keep.
+    @param generator: Random generator of the household keys.
+    @param minimum: The minimum number of households kept per stratum (limited to its households).
+    @return: Tuple of a boolean array selecting the records of the sampled households, and the ratio of
+    the households of each record's stratum to its sampled households (the weight expansion of the
+    sample, 0 for strata without a sampled household).
+    """
+    record_households = pd.factorize(np.asarray(household_ids))[0]
+    if fraction >= 1:
+        return np.ones(len(record_households), dtype=bool), np.ones(len(record_households), dtype=np.float64)
+
+    # stratum of each household, from its first record
+    first = np.unique(record_households, return_index=True)[1]
+    household_count = len(first)
+    stratum_codes = pd.factorize(np.asarray(strata)[first])[0]
+    keys = generator.random(household_count)
+
+    # rank of each household within its stratum, by key
+    order = np.lexsort((keys, stratum_codes))
+    counts = np.bincount(stratum_codes, minlength=stratum_codes.max(initial=-1) + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    ranks = np.empty(household_count, dtype=np.int64)
+    ranks[order] = np.arange(household_count) - starts[stratum_codes[order]]
+
+    sizes = np.minimum(np.maximum(np.round(counts * fraction).astype(np.int64), minimum), counts)
+    selected = ranks < sizes[stratum_codes]
+    expansion = np.divide(counts, sizes, out=np.zeros(len(counts), dtype=np.float64), where=sizes > 0)
+    return selected[record_households], expansion[stratum_codes][record_households]
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def zone_category_sums(zone_codes: np.ndarray, category_codes: np.ndarray, weights: np.ndarray,
+                       zone_count: int, category_count: int) -> np.ndarray:
+    """
+    Computes the weighted sum of every zone x category cell in a single grouped aggregation.
+
+    Records are stably sorted by their (zone, category) cell and reduced segment by segment with
+    numpy's own add reduction. Each segment is prefixed with a zero so that its reduction is
+    performed in exactly the same order as calling pandas ``Series.sum`` on the masked records of
+    that zone, which keeps the results bit-identical to per-zone ``groupby().apply`` sums (a
+    weighted ``bincount`` accumulates sequentially and may differ in the last bits).
+
+    Records with a negative zone or category code are ignored, missing weights count as 0.
+    @param zone_codes: Integer position of each record's zone, -1 for records outside the zone set.
+    @param category_codes: Integer category of each record, -1 for records that belong to no category.
+    @param weights: The weight (expansion factor) of each record.
+    @param zone_count: Number of zones (rows) in the result.
+    @param category_count: Number of categories (columns) in the result.
+    @return: A zone_count x category_count float64 array of weighted sums.
+    """
+    zone_codes = np.asarray(zone_codes, dtype=np.int64)
+    category_codes = np.asarray(category_codes, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+
+    valid = (zone_codes >= 0) & (category_codes >= 0)
+    cells = zone_codes[valid] * category_count + category_codes[valid]
+    values = weights[valid]
+    values = np.where(np.isnan(values), 0.0, values)
+
+    sums = np.zeros(zone_count * category_count, dtype=np.float64)
+    if cells.size == 0:
+        return sums.reshape(zone_count, category_count)
+
+    order = np.argsort(cells, kind='stable')
+    values = values[order]
+
+    counts = np.bincount(cells, minlength=zone_count * category_count)
+    occupied = counts > 0
+    segment_counts = counts[occupied]
+    segment_index = np.arange(segment_counts.size)
+
+    # interleave a leading zero before every segment: [0, a0, a1, .., 0, b0, b1, ..]
+    padded = np.zeros(values.size + segment_counts.size, dtype=np.float64)
+    padded[np.arange(values.size) + np.repeat(segment_index + 1, segment_counts)] = values
+    segment_starts = np.cumsum(segment_counts) - segment_counts + segment_index
+
+    sums[occupied] = np.add.reduceat(padded, segment_starts)
+    return sums.reshape(zone_count, category_count)
@@ -0,0 +1,49 @@
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class ZoneNeighbours(object):
+    """
+    Nearest neighbour index over a set of zone centroids. The index is built once and queried for any
+    number of points in a single vectorized call. A KD-tree is used when scipy is available, otherwise
+    the neighbours are found by blocked brute force distance computations.
+    """
+
+    BLOCK_SIZE = 1024
+
+    def __init__(self, coordinates: np.ndarray):
+        """
+
+        @param coordinates: n x 2 array of zone centroid coordinates (X, Y).
+        """
+        self._coordinates = np.asarray(coordinates, dtype=np.float64)
+        self._tree = cKDTree(self._coordinates) if cKDTree is not None else None
+
+    def query(self, points: np.ndarray, k: int) -> np.ndarray:
+        """
+        Finds the k nearest indexed zones of each point.
+        @param points: m x 2 array of query coordinates.
+        @param k: Number of neighbours, capped at the number of indexed zones.
+        @return: m x k array of positions in the indexed coordinates, nearest first.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        k = min(k, len(self._coordinates))
+        if len(points) == 0 or k == 0:
+            return np.zeros((len(points), k), dtype=np.int64)
+
+        if self._tree is not None:
+            _, neighbours = self._tree.query(points, k=k)
+            return np.asarray(neighbours, dtype=np.int64).reshape(len(points), k)
+
+        neighbours = np.empty((len(points), k), dtype=np.int64)
+        for start in range(0, len(points), self.BLOCK_SIZE):
+            block = points[start:start + self.BLOCK_SIZE]
+            distances = ((block[:, None, :] - self._coordinates[None, :, :]) ** 2).sum(axis=2)
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(distances, nearest, axis=1), axis=1, kind='stable')
+            neighbours[start:start + len(block)] = np.take_along_axis(nearest, order, axis=1)
+        return neighbours
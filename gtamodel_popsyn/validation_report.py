@@ -1,10 +1,13 @@
 import os
 
+import numpy as np
 import pandas as pd
 
 from gtamodel_popsyn._gtamodel_popsyn_processor import GTAModelPopSynProcessor
+from gtamodel_popsyn.aggregation_cube import AggregationCube, population_cubes, file_signatures
 from gtamodel_popsyn.constants import *
 from gtamodel_popsyn.util.generate_zone_ranges import generate_zone_ranges
+from gtamodel_popsyn.util.read_seed_file import read_seed_file, PERSONS_SEED_SCHEMA, HOUSEHOLDS_SEED_SCHEMA
 
 
 class ValidationReport(GTAModelPopSynProcessor):
@@ -30,6 +33,8 @@ class ValidationReport(GTAModelPopSynProcessor):
         self._persons_synthesized = pd.DataFrame()
         self._persons_households_synthesized = pd.DataFrame()
         self._zones = pd.DataFrame()
+        self._persons_totals = {}
+        self._households_totals = {}
 
     def generate(self):
         """
@@ -48,52 +53,72 @@ class ValidationReport(GTAModelPopSynProcessor):
         Reads in all output data
         :return:
         """
-        self._households_original = pd.read_csv(f"{self._config['HouseholdsSeedFile']}")
-        self._persons_original = pd.read_csv(f"{self._config['PersonsSeedFile']}")
+        self._households_original = read_seed_file(f"{self._config['HouseholdsSeedFile']}", HOUSEHOLDS_SEED_SCHEMA,
+                                                    chunk_size=self._config.get('SeedChunkSize'))
+        self._persons_original = read_seed_file(f"{self._config['PersonsSeedFile']}", PERSONS_SEED_SCHEMA,
+                                                chunk_size=self._config.get('SeedChunkSize'))
         self._meta_control_totals = pd.read_csv(f"{self._output_path}/Inputs/{self._config['MetaLevelControls']}")
+
+        self._zones = pd.read_csv(self._config['Zones'])
+
+    def _read_synthesized_cubes(self) -> dict:
+        """
+        Reads the aggregated synthesized population written by the output processor, or aggregates the
+        synthesized output files when the aggregations are not available or were built from other versions
+        of the output files.
+        :return:
+        """
+        folder = f'{self._output_path}/Aggregations'
+        output_files = [f'{self._output_path}/{self._config["HouseholdsOutputFile"]}',
+                        f'{self._output_path}/{self._config["PersonsOutputFile"]}']
+        # without the output files, the aggregations are the only record of the synthesized population
+        sources = file_signatures(output_files) if all(os.path.isfile(f) for f in output_files) else None
+        if all(os.path.isfile(f'{folder}/{name}.npz') and
+               (sources is None or AggregationCube.saved_sources(f'{folder}/{name}.npz') == sources)
+               for name in ['persons', 'households']):
+            return {name: AggregationCube.load(f'{folder}/{name}.npz') for name in ['persons', 'households']}
+        self._logger.info('Aggregating the synthesized output files.')
+
         self._households_synthesized = pd.read_csv(
             f'{self._output_path}/{self._config["HouseholdsOutputFile"]}')
         self._persons_synthesized = pd.read_csv(
             f'{self._output_path}/{self._config["PersonsOutputFile"]}')
+        self._persons_synthesized['EmploymentZone'] = self._persons_synthesized['EmploymentZone'].astype(int)
 
-        self._zones = pd.read_csv(self._config['Zones'])
+        self._persons_households_synthesized = pd.merge(self._persons_synthesized, self._households_synthesized,
+                                                        left_on="HouseholdId", right_on="HouseholdId")
+        self._persons_households_synthesized = self._persons_households_synthesized.rename(
+            columns={'ExpansionFactor_x': 'ExpansionFactor'})
+        return population_cubes(self._persons_households_synthesized, self._households_synthesized,
+                                person_weight='ExpansionFactor', household_weight='ExpansionFactor',
+                                zone_index=self.popsyn_config.zone_index)
 
     def _process(self):
         self._zones = self._zones[['Zone', 'PD']].rename(columns={'Zone': 'HouseholdZone'})
 
-        self._persons_synthesized['EmploymentZone'] = self._persons_synthesized['EmploymentZone'].astype(int)
         self._persons_original['EmploymentZone'] = self._persons_original['EmploymentZone'].astype(int)
 
         self._persons_households_original = pd.merge(self._persons_original, self._households_original,
                                                      left_on="HouseholdId", right_on="HouseholdId")
-        self._persons_households_original = pd.merge(self._persons_households_original, self._zones,
-                                                     left_on="HouseholdZone", right_on="HouseholdZone")
-
-        self._persons_households_synthesized = pd.merge(self._persons_synthesized, self._households_synthesized,
-                                                        left_on="HouseholdId", right_on="HouseholdId")
-        self._persons_households_synthesized = pd.merge(self._persons_households_synthesized, self._zones,
-                                                        left_on="HouseholdZone", right_on="HouseholdZone")
-
-        self._persons_households_synthesized = self._persons_households_synthesized[
-            self._persons_households_synthesized['PD'] > 0]
-        self._persons_households_original = self._persons_households_original[
-            self._persons_households_original['PD'] > 0]
-
-        self._persons_households_synthesized = self._persons_households_synthesized[
-            self._persons_households_synthesized['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
-        self._persons_households_original = self._persons_households_original[
-            self._persons_households_original['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
+        self._persons_households_original = self._persons_households_original.rename(
+            columns={'ExpansionFactor_x': 'ExpansionFactor'})
 
-        self._households_original = self._households_original[
-            self._households_original['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
+        original_cubes = population_cubes(self._persons_households_original, self._households_original,
+                                          person_weight='ExpansionFactor', household_weight='ExpansionFactor',
+                                          zone_index=self.popsyn_config.zone_index)
+        synthesized_cubes = self._read_synthesized_cubes()
 
-        self._households_synthesized = self._households_synthesized[
-            self._households_synthesized['HouseholdZone'].isin(self.popsyn_config.internal_zone_range)]
+        # persons are totalled over the internal zones with a PD, households over all internal zones
+        zone_index = self.popsyn_config.zone_index
+        persons_zones = self._zones.loc[(self._zones['PD'] > 0) & zone_index.is_internal(self._zones['HouseholdZone']),
+                                        'HouseholdZone'].unique()
+        persons_region = pd.Series(1, index=persons_zones)
+        households_region = pd.Series(1, index=zone_index.internal_zones)
 
-        self._persons_households_synthesized = self._persons_households_synthesized.rename(
-            columns={'ExpansionFactor_x': 'ExpansionFactor'})
-        self._persons_households_original = self._persons_households_original.rename(
-            columns={'ExpansionFactor_x': 'ExpansionFactor'})
+        self._persons_totals = {'Observed Total': original_cubes['persons'].roll_up(persons_region),
+                                'Synthesized Total': synthesized_cubes['persons'].roll_up(persons_region)}
+        self._households_totals = {'Observed Total': original_cubes['households'].roll_up(households_region),
+                                   'Synthesized Total': synthesized_cubes['households'].roll_up(households_region)}
 
         # self._process_occupation_employment_zone()
 
@@ -106,112 +131,26 @@ class ValidationReport(GTAModelPopSynProcessor):
         Processes and output region totals for person level attributes, and write the comparison to file.
         :return:
         """
+        external_zone_types = ['external']
+        if self.popsyn_config.zone_index.is_external(ROAMING_ZONE_ID):
+            external_zone_types.append('roaming')
+
+        rows = [('Population', {}), ('Male', {'Sex': 'M'}), ('Female', {'Sex': 'F'})] + \
+               [(f'Occupation {occupation}', {'Occupation': occupation})
+                for occupation in ['P', 'G', 'S', 'M', 'O']] + \
+               [(f'EmploymentStatus {status}', {'EmploymentStatus': status})
+                for status in ['F', 'P', 'O', 'H', 'J']] + \
+               [('EmploymentZone Internal', {'EmploymentZoneType': 'internal'}),
+                ('EmploymentZone Roaming', {'EmploymentZoneType': 'roaming'}),
+                ('EmploymentZone External', {'EmploymentZoneType': external_zone_types})] + \
+               [(f'StudentStatus {status}', {'StudentStatus': status}) for status in ['S', 'P', 'O']] + \
+               [(f'Age {bin.start} - {bin.stop}',
+                 {'Age': lambda age, bin=bin: (age >= bin.start) & (age <= bin.stop)}) for bin in AGE_BINS]
 
         totals = pd.DataFrame(columns=['Observed Total', 'Synthesized Total', 'Abs. Difference'],
-                              index=['Population', 'Male', 'Female',
-                                     'Occupation P', 'Occupation G', 'Occupation S', 'Occupation M', 'Occupation O'])
-
-        totals.loc['Population', 'Observed Total'] = self._persons_households_original['ExpansionFactor'].sum()
-        totals.loc['Population', 'Synthesized Total'] = self._persons_households_synthesized['ExpansionFactor'].sum()
-
-        totals.loc['Male', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Sex == 'M', 'ExpansionFactor'].sum()
-        totals.loc['Male', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Sex == 'M', 'ExpansionFactor'].sum()
-
-        totals.loc['Female', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Sex == 'F', 'ExpansionFactor'].sum()
-        totals.loc['Female', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Sex == 'F', 'ExpansionFactor'].sum()
-
-        totals.loc['Occupation P', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Occupation == 'P', 'ExpansionFactor'].sum()
-        totals.loc['Occupation P', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Occupation == 'P', 'ExpansionFactor'].sum()
-
-        totals.loc['Occupation G', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Occupation == 'G', 'ExpansionFactor'].sum()
-        totals.loc['Occupation G', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Occupation == 'G', 'ExpansionFactor'].sum()
-
-        totals.loc['Occupation S', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Occupation == 'S', 'ExpansionFactor'].sum()
-        totals.loc['Occupation S', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Occupation == 'S', 'ExpansionFactor'].sum()
-
-        totals.loc['Occupation M', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Occupation == 'M', 'ExpansionFactor'].sum()
-        totals.loc['Occupation M', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Occupation == 'M', 'ExpansionFactor'].sum()
-
-        totals.loc['Occupation O', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.Occupation == 'O', 'ExpansionFactor'].sum()
-        totals.loc['Occupation O', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.Occupation == 'O', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentStatus F', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentStatus == 'F', 'ExpansionFactor'].sum()
-        totals.loc['EmploymentStatus F', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentStatus == 'F', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentStatus P', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentStatus == 'P', 'ExpansionFactor'].sum()
-        totals.loc['EmploymentStatus P', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentStatus == 'P', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentStatus O', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentStatus == 'O', 'ExpansionFactor'].sum()
-        totals.loc['EmploymentStatus O', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentStatus == 'O', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentStatus H', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentStatus == 'H', 'ExpansionFactor'].sum()
-        totals.loc['EmploymentStatus H', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentStatus == 'H', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentStatus J', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentStatus == 'J', 'ExpansionFactor'].sum()
-        totals.loc['EmploymentStatus J', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentStatus == 'J', 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentZone Internal', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentZone.isin(self.popsyn_config.internal_zone_range), 'ExpansionFactor'].sum()
-        totals.loc['EmploymentZone Internal', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentZone.isin(self.popsyn_config.internal_zone_range), 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentZone Roaming', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentZone == ROAMING_ZONE_ID, 'ExpansionFactor'].sum()
-        totals.loc['EmploymentZone Roaming', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentZone == ROAMING_ZONE_ID, 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentZone External', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.EmploymentZone.isin(self.popsyn_config.external_zone_range), 'ExpansionFactor'].sum()
-
-        totals.loc['EmploymentZone External', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.EmploymentZone.isin(self.popsyn_config.external_zone_range), 'ExpansionFactor'].sum()
-
-        totals.loc['StudentStatus S', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.StudentStatus == 'S', 'ExpansionFactor'].sum()
-        totals.loc['StudentStatus S', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.StudentStatus == 'S', 'ExpansionFactor'].sum()
-
-        totals.loc['StudentStatus P', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.StudentStatus == 'P', 'ExpansionFactor'].sum()
-        totals.loc['StudentStatus P', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.StudentStatus == 'P', 'ExpansionFactor'].sum()
-
-        totals.loc['StudentStatus O', 'Observed Total'] = self._persons_households_original.loc[
-            self._persons_households_original.StudentStatus == 'O', 'ExpansionFactor'].sum()
-        totals.loc['StudentStatus O', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-            self._persons_households_synthesized.StudentStatus == 'O', 'ExpansionFactor'].sum()
-
-        for bin in AGE_BINS:
-            totals.loc[f'Age {bin.start} - {bin.stop}', 'Observed Total'] = self._persons_households_original.loc[
-                (self._persons_households_original.Age >= bin.start) & (
-                        self._persons_households_original.Age <= bin.stop), 'ExpansionFactor'].sum()
-            totals.loc[f'Age {bin.start} - {bin.stop}', 'Synthesized Total'] = self._persons_households_synthesized.loc[
-                (self._persons_households_synthesized.Age >= bin.start) & (
-                        self._persons_households_synthesized.Age <= bin.stop), 'ExpansionFactor'].sum()
+                              index=[row for row, _ in rows])
+        for column, cube in self._persons_totals.items():
+            totals[column] = [cube.total(**selection) for _, selection in rows]
 
         totals['Abs. Difference'] = totals['Observed Total'] - totals['Synthesized Total']
         totals.to_csv(f'{self._output_path}/Validation/persons_totals.csv', index=True)
@@ -222,65 +161,15 @@ class ValidationReport(GTAModelPopSynProcessor):
 
         :return:
         """
-        totals = pd.DataFrame(columns=['Observed Total', 'Synthesized Total', 'Abs. Difference'])
-
-        totals.loc['Total Households', 'Observed Total'] = self._households_original['ExpansionFactor'].sum()
-        totals.loc['Total Households', 'Synthesized Total'] = self._households_synthesized['ExpansionFactor'].sum()
-
-        totals.loc['Income Class 1', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 1, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 1', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 1, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 2', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 2, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 2', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 2, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 3', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 3, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 3', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 3, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 4', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 4, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 4', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 4, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 5', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 5, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 5', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 5, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 6', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 6, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 6', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 6, 'ExpansionFactor'].sum()
-
-        totals.loc['Income Class 7', 'Observed Total'] = self._households_original.loc[
-            self._households_original.IncomeClass == 7, 'ExpansionFactor'].sum()
-        totals.loc['Income Class 7', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.IncomeClass == 7, 'ExpansionFactor'].sum()
-
-        totals.loc['Number of Persons 1', 'Observed Total'] = self._households_original.loc[
-            self._households_original.NumberOfPersons == 1, 'ExpansionFactor'].sum()
-        totals.loc['Number of Persons 1', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.NumberOfPersons == 1, 'ExpansionFactor'].sum()
-
-        totals.loc['Number of Persons 2', 'Observed Total'] = self._households_original.loc[
-            self._households_original.NumberOfPersons == 2, 'ExpansionFactor'].sum()
-        totals.loc['Number of Persons 2', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.NumberOfPersons == 2, 'ExpansionFactor'].sum()
-
-        totals.loc['Number of Persons 3', 'Observed Total'] = self._households_original.loc[
-            self._households_original.NumberOfPersons == 3, 'ExpansionFactor'].sum()
-        totals.loc['Number of Persons 3', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.NumberOfPersons == 3, 'ExpansionFactor'].sum()
-
-        totals.loc['Number of Persons 4+', 'Observed Total'] = self._households_original.loc[
-            self._households_original.NumberOfPersons >= 4, 'ExpansionFactor'].sum()
-        totals.loc['Number of Persons 4+', 'Synthesized Total'] = self._households_synthesized.loc[
-            self._households_synthesized.NumberOfPersons >= 4, 'ExpansionFactor'].sum()
+        rows = [('Total Households', {})] + \
+               [(f'Income Class {income_class}', {'IncomeClass': income_class}) for income_class in range(1, 8)] + \
+               [(f'Number of Persons {size}', {'NumberOfPersons': size}) for size in range(1, 4)] + \
+               [('Number of Persons 4+', {'NumberOfPersons': lambda size: size >= 4})]
+
+        totals = pd.DataFrame(columns=['Observed Total', 'Synthesized Total', 'Abs. Difference'],
+                              index=[row for row, _ in rows])
+        for column, cube in self._households_totals.items():
+            totals[column] = [cube.total(**selection) for _, selection in rows]
 
         totals['Abs. Difference'] = totals['Observed Total'] - totals['Synthesized Total']
         totals.to_csv(f'{self._output_path}/Validation/households_totals.csv', index=True)
@@ -291,15 +180,12 @@ class ValidationReport(GTAModelPopSynProcessor):
         :return:
         """
 
-        self._persons_households_original['EmploymentZoneType'] = self._persons_households_original.apply(
-            lambda x: ('Roaming' if x['EmploymentZone'] == ROAMING_ZONE_ID
-                       else (
-                'Internal' if x['EmploymentZone'].isin(self.popsyn_config.internal_zone_range) else 'External')), axis=1)
-
-        self._persons_households_synthesized['EmploymentZoneType'] = self._persons_households_synthesized.apply(
-            lambda x: ('Roaming' if x['EmploymentZone'] == ROAMING_ZONE_ID
-                       else (
-                'Internal' if x['EmploymentZone'].isin(self.popsyn_config.internal_zone_range) else 'External')), axis=1)
+        zone_index = self.popsyn_config.zone_index
+        for persons_households in [self._persons_households_original, self._persons_households_synthesized]:
+            employment_zones = persons_households['EmploymentZone'].to_numpy()
+            persons_households['EmploymentZoneType'] = np.select(
+                [employment_zones == ROAMING_ZONE_ID, zone_index.is_internal(employment_zones)],
+                ['Roaming', 'Internal'], default='External')
 
         group_original = self._persons_households_original.groupby(
             ['PD', 'Occupation', 'EmploymentStatus', 'EmploymentZoneType'])[